@@ -1,98 +1,212 @@
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage,
-    LocationMessage, LocationSendMessage, PostbackEvent,
-    ImagemapSendMessage, BaseSize, URIImagemapAction, ImagemapArea,
-    ImageSendMessage
-)
+import functools
+import multiprocessing
 import os
 import sys
-from dotenv import load_dotenv
-from collections import defaultdict
-import matplotlib
-matplotlib.use('Agg')  # 設定使用非互動式後端
-import matplotlib.pyplot as plt
-import pandas as pd
-from datetime import datetime, timedelta
-import seaborn as sns
-import numpy as np
+import threading
+import time
+
+_module_start = time.perf_counter()
 
 # 添加專案根目錄到 Python 路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from app.services.drink_service import DrinkService
-from app.services.gemini_service import GeminiService
-from app.services.store_service import StoreService
+from app.services.startup_report import startup_report
+
+with startup_report.phase('import flask/linebot'):
+    from flask import Flask, request, abort, jsonify
+    from linebot import LineBotApi, WebhookHandler
+    from linebot.exceptions import InvalidSignatureError, LineBotApiError
+    from linebot.models import (
+        MessageEvent, TextMessage, TextSendMessage,
+        LocationMessage, LocationSendMessage, PostbackEvent,
+        ImagemapSendMessage, BaseSize, URIImagemapAction, ImagemapArea,
+        ImageSendMessage
+    )
+from dotenv import load_dotenv
+from datetime import datetime, timedelta
+
+# 服務皆在第一次使用時才初始化，避免 worker 啟動時呼叫外部 API 或載入大型套件
+with startup_report.phase('import services'):
+    from app.services.chart_cache import CHART_URL_PREFIX, chart_key, get_chart_cache
+    from app.services.chart_renderer import ChartRenderTimeout, get_chart_renderer
+    from app.services.drink_catalog import get_drink_catalog
+    from app.services.drink_recommender import get_drink_recommender
+    from app.services.drink_service import TOP_DRINKS_COUNT, get_drink_service
+    from app.services.entity_extractor import get_entity_extractor
+    from app.services.event_dispatcher import get_event_dispatcher
+    from app.services.fuzzy_matcher import get_fuzzy_matcher
+    from app.services.gemini_service import get_gemini_service, recommendation_cache_stats
+    from app.services.http_client import get_http_client
+    from app.services.single_flight import single_flight_stats
+    from app.services.upstream_guard import upstream_guard_stats
+    from app.services.state_store import get_state_store
+    from app.services.store_service import get_store_service, order_queue_stats
 
 # 載入環境變數
 load_dotenv()
 
 app = Flask(__name__, static_folder='../../static')
 
+# 回覆權杖的有效時間（秒）：超過時改用推播訊息
+REPLY_TOKEN_TTL = 50
+
+# 對外網址（圖表連結用）；未設定時使用最近一次 webhook 請求的主機名稱
+PUBLIC_HOST = os.getenv('PUBLIC_HOST')
+_last_request_host = None
+
+# 是否在載入模組時於背景初始化店家服務（預設關閉：每個 gunicorn worker 載入時都會執行）
+WARM_UP_ON_IMPORT = os.getenv('WARM_UP_ON_IMPORT', 'false').lower() == 'true'
+
+def _event_key(event):
+    """
+    事件的排序鍵：同一位使用者（或群組、聊天室）的事件依序處理
+    """
+    source = event.source
+    return (
+        getattr(source, 'user_id', None)
+        or getattr(source, 'group_id', None)
+        or getattr(source, 'room_id', None)
+        or 'anonymous'
+    )
+
+def _event_label(event):
+    # 事件類型，例如 message/text、postback（用於計時統計）
+    message = getattr(event, 'message', None)
+    return f"{event.type}/{message.type}" if message is not None else event.type
+
+class QueuedWebhookHandler(WebhookHandler):
+    """
+    驗證簽章並解析事件後立即回應 LINE，事件交由背景執行緒池並行處理（同一使用者的事件依序處理）
+    """
+    
+    def __init__(self, channel_secret):
+        super().__init__(channel_secret)
+        # (事件類別, 訊息類別或 None) -> 處理函式
+        self._routes = {}
+    
+    def add(self, event, message=None):
+        """
+        註冊事件處理函式（處理函式只接受 event 一個參數）
+        """
+        def decorator(func):
+            messages = message if isinstance(message, (list, tuple)) else [message]
+            for message_class in messages:
+                self._routes[(event, message_class)] = func
+            return func
+        return decorator
+    
+    def handle(self, body, signature):
+        """
+        驗證簽章並解析事件，將每個事件排入事件處理執行緒池
+        """
+        payload = self.parser.parse(body, signature, as_payload=True)
+        for event in payload.events:
+            func = None
+            if isinstance(event, MessageEvent):
+                func = self._routes.get((type(event), type(event.message)))
+            func = func or self._routes.get((type(event), None))
+            if func is None:
+                continue
+            task = functools.partial(func, event)
+            if not get_event_dispatcher().submit(_event_key(event), task, _event_label(event)):
+                # 佇列已滿：直接在請求中處理，讓 LINE 的請求變慢以形成背壓，而不是丟棄事件
+                print("事件佇列已滿，改為同步處理")
+                task()
+
 # LINE Bot 設定
 line_bot_api = LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
-handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
+handler = QueuedWebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
 
-# 初始化服務
-drink_service = DrinkService()
-gemini_service = GeminiService()
-store_service = StoreService()
+def _reply(event, message):
+    """
+    回覆訊息：回覆權杖仍有效時使用回覆，否則（或回覆失敗時）改用推播
+    """
+    age = time.time() - event.timestamp / 1000
+    if event.reply_token and age < REPLY_TOKEN_TTL:
+        try:
+            line_bot_api.reply_message(event.reply_token, message)
+            return
+        except LineBotApiError as e:
+            print(f"回覆訊息失敗（{e.status_code}），改用推播：{e.error.message}")
+    line_bot_api.push_message(event.source.user_id, message)
 
-# 使用者狀態管理
-user_states = defaultdict(dict)
+def _public_host():
+    return PUBLIC_HOST or _last_request_host
 
-def handle_drink_comparison(text):
+def _warm_up_store_service():
     """
-    處理飲料比較的邏輯
+    在背景初始化店家服務：驗證 API 金鑰並重播未寫入 Google Sheets 的訂單
     """
     try:
-        # 移除「比較」並分割成兩部分
-        parts = text.replace("比較", "").split("和")
-        if len(parts) != 2:
-            raise ValueError("格式錯誤")
-        
-        # 解析第一部分（店家A的飲料A）
-        part1 = parts[0].strip()
-        if "的" not in part1:
-            raise ValueError("格式錯誤")
-        brand1, drink1 = part1.split("的")
-        
-        # 解析第二部分（店家B的飲料B）
-        part2 = parts[1].strip()
-        if "的" not in part2:
-            raise ValueError("格式錯誤")
-        brand2, drink2 = part2.split("的")
-        
-        # 使用 DrinkService 進行比較
-        return drink_service.compare_drinks(
-            brand1.strip(), drink1.strip(),
-            brand2.strip(), drink2.strip()
-        )
-    except ValueError:
+        get_store_service()
+    except Exception as e:
+        print(f"初始化店家服務時發生錯誤：{str(e)}")
+
+# 繪圖程序以 spawn 啟動時會重新載入本模組（直接執行 webhook.py 時），只在主程序預熱服務；
+# 繪圖程序池則在第一次畫圖時才建立
+if WARM_UP_ON_IMPORT and multiprocessing.current_process().name == 'MainProcess':
+    threading.Thread(target=_warm_up_store_service, daemon=True).start()
+
+# 使用者對話狀態（預設存在 SQLite，多個 gunicorn worker 共用，閒置過久自動失效）
+state_store = get_state_store()
+
+def _drink_refs(parsed):
+    """
+    取得訊息中同時有品牌與飲料文字的片段
+    """
+    return [ref for ref in get_entity_extractor().drink_refs(parsed) if ref.brand and ref.drink_text]
+
+def handle_drink_comparison(text, parsed=None):
+    """
+    處理飲料比較的邏輯
+    """
+    parsed = parsed or get_entity_extractor().parse(text)
+    refs = _drink_refs(parsed)
+    if len(refs) != 2:
         return "請使用正確的格式：比較[店家A]的[飲料A]和[店家B]的[飲料B]\n例如：比較五十嵐的珍珠奶茶和清心的烏龍綠茶"
+    
+    # 使用 DrinkService 進行比較
+    return get_drink_service().compare_drinks(
+        refs[0].brand, refs[0].drink_text,
+        refs[1].brand, refs[1].drink_text
+    )
 
-def handle_drink_search(text):
+def handle_drink_search(text, parsed=None):
     """
     處理飲料查詢的邏輯
     """
-    try:
-        if "的" not in text:
-            raise ValueError("格式錯誤")
-        
-        brand, drink_name = text.split("的")
-        return drink_service.search_drink(brand.strip(), drink_name.strip())
-    except ValueError:
+    parsed = parsed or get_entity_extractor().parse(text)
+    refs = _drink_refs(parsed)
+    if not refs:
         return "請使用正確的格式：[店家]的[飲料名稱]\n例如：五十嵐的珍珠奶茶"
+    
+    return get_drink_service().search_drink(refs[0].brand, refs[0].drink_text)
+
+def handle_calorie_query(constraints):
+    """
+    處理熱量範圍與熱量排名的查詢（例如「200大卡以下的茶」、「清心福全熱量最低的奶茶前5名」）
+    """
+    drink_service = get_drink_service()
+    if constraints.order or constraints.limit:
+        return drink_service.get_top_drinks(
+            constraints.limit or TOP_DRINKS_COUNT,
+            brand=constraints.brand,
+            drink_types=constraints.types,
+            lightest=constraints.order != 'high',
+            min_calories=constraints.min_calories,
+            max_calories=constraints.max_calories
+        )
+    return drink_service.search_calorie_range(
+        constraints.min_calories, constraints.max_calories,
+        brand=constraints.brand, drink_types=constraints.types
+    )
 
 def handle_store_selection(user_id: str, brand: str):
     """
     處理店家選擇的邏輯
     """
     # 更新使用者狀態
-    user_states[user_id]['brand'] = brand
-    user_states[user_id]['state'] = 'waiting_for_location'
+    state_store.update(user_id, brand=brand, state='waiting_for_location')
     
     return "📍請傳送您的位置資訊～\n我會幫您搜尋附近的飲料店！"
 
@@ -102,18 +216,17 @@ def handle_location(user_id: str, latitude: float, longitude: float):
     """
     try:
         # 取得使用者選擇的店家
-        brand = user_states[user_id].get('brand')
+        brand = state_store.get(user_id).get('brand')
         if not brand:
             return "請先幫我選擇飲料店～🧋（五十嵐、清心福全、麻古茶坊）"
         
         # 搜尋附近的店家
-        stores = store_service.search_nearby_stores(brand, (latitude, longitude))
+        stores = get_store_service().search_nearby_stores(brand, (latitude, longitude))
         if not stores:
             return "找不到附近的店家噢～請重新選擇位置。"
         
         # 更新使用者狀態
-        user_states[user_id]['stores'] = stores
-        user_states[user_id]['state'] = 'waiting_for_store_selection'
+        state_store.update(user_id, stores=stores, state='waiting_for_store_selection')
         
         # 生成店家列表訊息
         message = "以下是我找到的店家👉🏻\n請選擇一間😊\n\n"
@@ -133,7 +246,7 @@ def handle_store_number(user_id: str, store_number: str):
     """
     try:
         # 取得店家列表
-        stores = user_states[user_id].get('stores', [])
+        stores = state_store.get(user_id).get('stores', [])
         if not stores:
             return "請先選擇位置"
         
@@ -147,8 +260,7 @@ def handle_store_number(user_id: str, store_number: str):
         
         # 更新使用者狀態
         selected_store = stores[index]
-        user_states[user_id]['selected_store'] = selected_store
-        user_states[user_id]['state'] = 'waiting_for_drink'
+        state_store.update(user_id, selected_store=selected_store, state='waiting_for_drink')
         
         return f"收到🫡\n您選擇了：{selected_store['name']}\n最後請輸入您要點的飲料名稱"
     except Exception as e:
@@ -160,34 +272,37 @@ def handle_drink_selection(user_id: str, drink_name: str):
     """
     try:
         # 取得使用者選擇的店家
-        brand = user_states[user_id].get('brand')
-        selected_store = user_states[user_id].get('selected_store')
+        user_state = state_store.get(user_id)
+        brand = user_state.get('brand')
+        selected_store = user_state.get('selected_store')
         if not brand or not selected_store:
             return "請重新開始點餐流程"
         
-        # 先檢查飲料是否存在
-        calories = store_service.get_drink_calories(brand, drink_name)
-        if calories is None:
-            # 取得該品牌的所有飲料
-            with open('data/drink_data.csv', 'r', encoding='utf-8') as f:
-                import csv
-                reader = csv.DictReader(f)
-                brand_drinks = [row['drink_name'] for row in reader if row['brand'] == brand]
+        # 只接受完全相符的飲料名稱或簡稱；相近的飲料列出候選請使用者重新輸入，不直接儲存
+        drink = get_fuzzy_matcher().resolve_drink(brand, drink_name)
+        if drink is None:
+            message = f"找不到飲料：{drink_name}\n\n"
+            suggestions = [drink.drink_name for drink in get_fuzzy_matcher().suggest_drinks(brand, drink_name, k=3)]
+            if suggestions:
+                return message + "您是不是要找：\n" + "\n".join(suggestions)
             
-            return f"找不到飲料：{drink_name}\n\n{brand}的飲料有：\n" + "\n".join(brand_drinks)
+            # 沒有相近的飲料時才列出該品牌的所有飲料
+            canonical_brand = get_fuzzy_matcher().resolve_brand(brand) or brand
+            brand_drinks = [drink.drink_name for drink in get_drink_catalog().get_brand_drinks(canonical_brand)]
+            return message + f"{brand}的飲料有：\n" + "\n".join(brand_drinks)
         
         # 儲存訂單
-        success = store_service.save_order(
+        success = get_store_service().save_order(
             user_id=user_id,
-            brand=brand,
+            brand=drink.brand,
             location=selected_store['name'],
-            drink_name=drink_name
+            drink_name=drink.drink_name
         )
         
         if success:
             # 清除使用者狀態
-            user_states[user_id].clear()
-            return "訂單已成功儲存🎉"
+            state_store.clear(user_id)
+            return f"訂單已成功儲存🎉\n{drink.brand} {drink.drink_name}（{drink.calories} 大卡）"
         else:
             return "儲存訂單時發生錯誤，請稍後再試。"
     except Exception as e:
@@ -196,59 +311,25 @@ def handle_drink_selection(user_id: str, drink_name: str):
 def generate_statistics_plots(user_id: str, start_date: str, end_date: str):
     """
     生成統計圖表
+    :return: (原圖路徑, 預覽圖路徑)（相對於 static 目錄）；超過期限時回傳提示訊息；沒有資料或失敗時回傳 None
     """
     try:
-        # 讀取訂單資料
-        orders = store_service.get_order_history(user_id, start_date, end_date)
-        if not orders:
+        # 讀取每日彙總（成本只與天數有關，與訂單筆數無關）
+        stats = get_store_service().get_order_statistics(user_id, start_date, end_date)
+        if not stats or not stats['total_count']:
             return None
         
-        # 轉換為 DataFrame
-        df = pd.DataFrame(orders)
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        
-        # 品牌名稱對應
-        brand_mapping = {
-            '五十嵐': 'FIFTYLAN',
-            '清心福全': 'QING XIN FU QUAN',
-            '麻古茶坊': 'MACU TEA'
-        }
-        
-        # 轉換品牌名稱為英文
-        df['brand'] = df['brand'].map(brand_mapping)
-        
-        # 創建圖表
-        plt.style.use('default')  # 使用預設樣式
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
-        
-        # 1. 品牌圓餅圖
-        brand_counts = df['brand'].value_counts()
-        colors = ['#FF9999', '#66B2FF', '#99FF99']  # 設定顏色
-        ax1.pie(brand_counts.values, labels=brand_counts.index, autopct='%1.1f%%', colors=colors)
-        ax1.set_title('Drink Brand Distribution', pad=20, fontsize=12)
-        
-        # 2. 每日飲料數量長條圖
-        # 將日期轉換為 YYYY/MM/DD 格式
-        df['date'] = df['created_at'].dt.strftime('%Y/%m/%d')
-        daily_counts = df.groupby('date').size()
-        
-        ax2.bar(daily_counts.index, daily_counts.values, color='#66B2FF')
-        ax2.set_title('Daily Drink Count', pad=20, fontsize=12)
-        ax2.set_xlabel('Date', fontsize=10)
-        ax2.set_ylabel('Count', fontsize=10)
-        plt.xticks(rotation=45)
-        
-        # 調整布局
-        plt.tight_layout()
-        
-        # 儲存圖表
-        static_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'static')
-        os.makedirs(static_dir, exist_ok=True)
-        plot_path = os.path.join(static_dir, 'statistics.png')
-        plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return plot_path
+        # 檔名由 (使用者, 日期區間, 統計資料) 決定：相同的圖表直接重用，不同使用者不會互相覆蓋
+        key = chart_key(user_id, start_date, end_date, stats)
+        # 在繪圖程序池中繪製，webhook 執行緒最多等待 CHART_RENDER_TIMEOUT 秒
+        return get_chart_cache().get_or_render(
+            key,
+            lambda full_path, preview_path: get_chart_renderer().render(stats, full_path, preview_path)
+        )
+    except ChartRenderTimeout as e:
+        # 繪圖程序會在背景完成並寫入快取，使用者稍後再要求即可直接取得
+        print(f"生成統計圖表逾時：{str(e)}")
+        return "圖表還在繪製中⏳ 請稍後再回覆「要」查看統計圖表"
     except Exception as e:
         print(f"生成統計圖表時發生錯誤：{str(e)}")
         return None
@@ -258,14 +339,14 @@ def handle_history_query(user_id: str, text: str):
     處理歷史紀錄查詢的邏輯
     """
     try:
-        state = user_states[user_id].get('history_state')
+        user_state = state_store.get(user_id)
+        state = user_state.get('history_state')
         
         if state == 'waiting_for_start_date':
             # 檢查日期格式是否正確
             try:
                 start_date = datetime.strptime(text, '%Y/%m/%d').strftime('%Y-%m-%d')
-                user_states[user_id]['start_date'] = start_date
-                user_states[user_id]['history_state'] = 'waiting_for_end_date'
+                state_store.update(user_id, start_date=start_date, history_state='waiting_for_end_date')
                 return "請輸入結束日期（格式：YYYY/MM/DD）"
             except ValueError:
                 return "日期格式錯誤，請使用 YYYY/MM/DD 格式（例如：2024/04/30）"
@@ -273,13 +354,13 @@ def handle_history_query(user_id: str, text: str):
         elif state == 'waiting_for_end_date':
             try:
                 end_date = datetime.strptime(text, '%Y/%m/%d').strftime('%Y-%m-%d')
-                start_date = user_states[user_id].get('start_date')
+                start_date = user_state.get('start_date')
                 
                 # 查詢歷史紀錄
-                orders = store_service.get_order_history(user_id, start_date, end_date)
+                orders = get_store_service().get_order_history(user_id, start_date, end_date)
                 
                 if not orders:
-                    user_states[user_id].clear()
+                    state_store.clear(user_id)
                     return f"在 {start_date} 到 {end_date} 期間沒有找到您的訂單紀錄"
                 
                 # 生成訂單列表訊息
@@ -291,10 +372,18 @@ def handle_history_query(user_id: str, text: str):
                     message += f"   熱量：{order['calories']} 卡路里\n"
                     message += f"   時間：{order['created_at']}\n\n"
                 
+                # 總計由每日彙總取得
+                stats = get_store_service().get_order_statistics(user_id, start_date, end_date)
+                if stats:
+                    message += f"共 {stats['total_count']} 杯，總熱量 {stats['total_calories']} 卡路里\n"
+                
                 # 更新狀態為等待使用者決定是否查看統計資料
-                user_states[user_id]['history_state'] = 'waiting_for_statistics_decision'
-                user_states[user_id]['start_date'] = start_date
-                user_states[user_id]['end_date'] = end_date
+                state_store.update(
+                    user_id,
+                    history_state='waiting_for_statistics_decision',
+                    start_date=start_date,
+                    end_date=end_date
+                )
                 
                 return message + "\n想要查看統計資料嗎😁我能幫你畫出圖表喔～\n\n👉🏻請回答「要」或「不要」"
             except ValueError:
@@ -303,27 +392,32 @@ def handle_history_query(user_id: str, text: str):
         elif state == 'waiting_for_statistics_decision':
             if text == "要":
                 # 生成統計圖表
-                plot_path = generate_statistics_plots(
+                chart = generate_statistics_plots(
                     user_id,
-                    user_states[user_id]['start_date'],
-                    user_states[user_id]['end_date']
+                    user_state['start_date'],
+                    user_state['end_date']
                 )
                 
-                if plot_path:
+                if isinstance(chart, str):
+                    # 圖表尚未完成，保留狀態讓使用者再回覆一次
+                    return chart
+                
+                if chart:
                     # 清除使用者狀態
-                    user_states[user_id].clear()
+                    state_store.clear(user_id)
                     
                     # 回傳圖表
+                    full_path, preview_path = chart
                     return ImageSendMessage(
-                        original_content_url=f"https://{request.host}/static/statistics.png",
-                        preview_image_url=f"https://{request.host}/static/statistics.png"
+                        original_content_url=f"https://{_public_host()}/static/{full_path}",
+                        preview_image_url=f"https://{_public_host()}/static/{preview_path}"
                     )
                 else:
-                    user_states[user_id].clear()
+                    state_store.clear(user_id)
                     return "生成統計圖表時發生錯誤，請稍後再試。"
             
             elif text == "不要":
-                user_states[user_id].clear()
+                state_store.clear(user_id)
                 return "謝謝您的使用！如果之後需要查看統計資料，隨時都可以查詢歷史紀錄。"
             
             else:
@@ -331,18 +425,145 @@ def handle_history_query(user_id: str, text: str):
         
         else:
             # 初始化查詢狀態
-            user_states[user_id]['history_state'] = 'waiting_for_start_date'
+            state_store.update(user_id, history_state='waiting_for_start_date')
             return "請輸入開始日期（格式：YYYY/MM/DD）"
     
     except Exception as e:
-        user_states[user_id].clear()
+        state_store.clear(user_id)
         return f"查詢歷史紀錄時發生錯誤：{str(e)}"
 
+def _menu_links_message():
+    return ImagemapSendMessage(
+        base_url='https://res.cloudinary.com/df8pqukj6/image/upload/v1748697999/link_zjrzoj.jpg#',  # 圖片網址
+        alt_text='點選前往官網',
+        base_size=BaseSize(height=520, width=1040),
+        actions=[
+            URIImagemapAction(
+                link_uri='http://50lan.com/web/products.asp',  # 五十嵐官網
+                area=ImagemapArea(x=0, y=0, width=346, height=520)
+            ),
+            URIImagemapAction(
+                link_uri='https://www.chingshin.tw/product.php',  # 清心福全官網
+                area=ImagemapArea(x=346, y=0, width=346, height=520)
+            ),
+            URIImagemapAction(
+                link_uri='https://www.macutea.com.tw',  # 麻古茶坊官網
+                area=ImagemapArea(x=692, y=0, width=348, height=520)
+            )
+        ]
+    )
+
+def _start_history_query(user_id):
+    state_store.update(user_id, history_state='waiting_for_start_date')
+    return "請輸入開始日期（格式：YYYY/MM/DD）"
+
+# 選單指令：訊息完全相符時的處理函式
+COMMAND_HANDLERS = {
+    "查詢飲料熱量": lambda user_id: "🔎請輸入飲料資訊。\n格式：[店家]的[飲料名稱]\n例如：五十嵐的珍珠奶茶\n\n也可以查詢熱量範圍或排名，例如：\n- 200大卡以下的茶\n- 清心福全熱量最低的奶茶前5名",
+    "飲料熱量比較": lambda user_id: "🔥請輸入兩店家的飲料資訊\n格式：比較店家A的飲料A和店家B的飲料B\n例如：比較五十嵐的珍珠奶茶和清心福全的紅茶拿鐵",
+    "AI 飲料推薦": lambda user_id: "💬請告訴我你想要什麼樣的飲料，例如：\n- 想要低熱量的飲料\n- 想要茶類的飲料\n- 想要有珍珠的飲料",
+    "點餐資料儲存": lambda user_id: "請先幫我選擇飲料店～🧋\n（五十嵐、清心福全、麻古茶坊）",
+    "歷史紀錄查詢": _start_history_query,
+    "官網菜單連結": lambda user_id: _menu_links_message(),
+}
+
+def _calorie_constraints(text, parsed=None):
+    """
+    解析訊息中的熱量查詢條件，不是熱量查詢時回傳 None
+    """
+    constraints = get_drink_recommender().parse(text, parsed)
+    return constraints if constraints and constraints.is_calorie_query else None
+
+# 自由文字的意圖：(意圖, 判斷條件, 處理函式)，依序比對，採用第一個符合的意圖
+# 判斷條件回傳比對結果（不符合時回傳 None 或 False），符合時將結果傳給處理函式，不需重新解析
+INTENT_ROUTES = [
+    (
+        'drink_comparison',
+        lambda text, parsed: '比較' in parsed.keywords,
+        lambda user_id, text, parsed, match: handle_drink_comparison(text, parsed)
+    ),
+    (
+        'recommendation',
+        lambda text, parsed: parsed.starts_with('想要') or parsed.starts_with('我想'),
+        lambda user_id, text, parsed, match: get_gemini_service().get_drink_recommendations(text)
+    ),
+    (
+        # 有熱量條件但沒有指定飲料，例如「200大卡以下的茶」、「熱量最低的奶茶前5名」
+        'calorie_query',
+        _calorie_constraints,
+        lambda user_id, text, parsed, constraints: handle_calorie_query(constraints)
+    ),
+    (
+        'drink_search',
+        lambda text, parsed: '的' in parsed.keywords or bool(_drink_refs(parsed)),
+        lambda user_id, text, parsed, match: handle_drink_search(text, parsed)
+    ),
+    (
+        # 其餘訊息視為店家選擇（有提到品牌時使用標準品牌名稱）
+        'store_selection',
+        lambda text, parsed: True,
+        lambda user_id, text, parsed, match: handle_store_selection(user_id, parsed.brands[0] if parsed.brands else text)
+    ),
+]
+
+def route_message(user_id: str, text: str):
+    """
+    依選單指令與訊息中的品牌、飲料、關鍵字決定處理方式（訊息只掃描一次）
+    """
+    command = COMMAND_HANDLERS.get(text)
+    if command:
+        return command(user_id)
+    
+    parsed = get_entity_extractor().parse(text)
+    for intent, matches, handle in INTENT_ROUTES:
+        match = matches(text, parsed)
+        if match:
+            return handle(user_id, text, parsed, match)
+
+# 圖表檔名由內容雜湊決定，內容不會改變，可讓 LINE 與瀏覽器長期快取
+CHART_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+@app.after_request
+def add_chart_cache_headers(response):
+    if request.path.startswith(f"/static/{CHART_URL_PREFIX}/") and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = CHART_CACHE_MAX_AGE
+        response.headers['Cache-Control'] += ', immutable'
+    return response
+
+@app.route("/startup", methods=['GET'])
+def startup():
+    """
+    回傳啟動時間報告
+    """
+    return jsonify(startup_report.report())
+
+@app.route("/upstreams", methods=['GET'])
+def upstreams():
+    # 外部服務的延遲統計、連線池狀態、合併呼叫次數、斷路器狀態、本地推薦省下的 Gemini 呼叫、推薦快取命中率與訂單寫回佇列
+    return jsonify({
+        "http": get_http_client().stats(),
+        "single_flight": single_flight_stats(),
+        "guards": upstream_guard_stats(),
+        "recommender": get_drink_recommender().stats(),
+        "recommendation_cache": recommendation_cache_stats(),
+        "order_queue": order_queue_stats()
+    })
+
+@app.route("/events", methods=['GET'])
+def events():
+    # 事件佇列深度與處理統計
+    return jsonify(get_event_dispatcher().stats())
+
 @app.route("/callback", methods=['POST'])
 def callback():
+    global _last_request_host
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
+    _last_request_host = request.host
     
+    # 只驗證簽章並排入事件，處理結果由背景執行緒以回覆或推播送出
     try:
         handler.handle(body, signature)
     except InvalidSignatureError:
@@ -355,90 +576,34 @@ def handle_message(event):
     user_id = event.source.user_id
     
     # 檢查使用者狀態
-    state = user_states[user_id].get('state')
-    history_state = user_states[user_id].get('history_state')
+    user_state = state_store.get(user_id)
+    state = user_state.get('state')
+    history_state = user_state.get('history_state')
     
     if history_state:
         # 處理歷史紀錄查詢
         response = handle_history_query(user_id, text)
         if isinstance(response, ImageSendMessage):
-            line_bot_api.reply_message(
-                event.reply_token,
-                response
-            )
+            _reply(event, response)
         else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=response)
-            )
+            _reply(event, TextSendMessage(text=response))
     elif state == 'waiting_for_store_selection':
         # 處理店家編號選擇
         response = handle_store_number(user_id, text)
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=response)
-        )
+        _reply(event, TextSendMessage(text=response))
     elif state == 'waiting_for_drink':
         # 處理飲料選擇
         response = handle_drink_selection(user_id, text)
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=response)
-        )
+        _reply(event, TextSendMessage(text=response))
     else:
         # 處理一般訊息
-        if text == "查詢飲料熱量":
-            response = "🔎請輸入飲料資訊。\n格式：[店家]的[飲料名稱]\n例如：五十嵐的珍珠奶茶"
-        elif text == "飲料熱量比較":
-            response = "🔥請輸入兩店家的飲料資訊\n格式：比較店家A的飲料A和店家B的飲料B\n例如：比較五十嵐的珍珠奶茶和清心福全的紅茶拿鐵"
-        elif text == "AI 飲料推薦":
-            response = "💬請告訴我你想要什麼樣的飲料，例如：\n- 想要低熱量的飲料\n- 想要茶類的飲料\n- 想要有珍珠的飲料"
-        elif text == "點餐資料儲存":
-            response = "請先幫我選擇飲料店～🧋\n（五十嵐、清心福全、麻古茶坊）"
-        elif text == "歷史紀錄查詢":
-            response = "請輸入開始日期（格式：YYYY/MM/DD）"
-            user_states[user_id]['history_state'] = 'waiting_for_start_date'
-        elif text == "官網菜單連結":
-            response = ImagemapSendMessage(
-                base_url='https://res.cloudinary.com/df8pqukj6/image/upload/v1748697999/link_zjrzoj.jpg#',  # 圖片網址
-                alt_text='點選前往官網',
-                base_size=BaseSize(height=520, width=1040),
-                actions=[
-                    URIImagemapAction(
-                        link_uri='http://50lan.com/web/products.asp',  # 五十嵐官網
-                        area=ImagemapArea(x=0, y=0, width=346, height=520)
-                    ),
-                    URIImagemapAction(
-                        link_uri='https://www.chingshin.tw/product.php',  # 清心福全官網
-                        area=ImagemapArea(x=346, y=0, width=346, height=520)
-                    ),
-                    URIImagemapAction(
-                        link_uri='https://www.macutea.com.tw',  # 麻古茶坊官網
-                        area=ImagemapArea(x=692, y=0, width=348, height=520)
-                    )
-                ]
-            )
-        elif "比較" in text:
-            response = handle_drink_comparison(text)
-        elif text.startswith("想要") or text.startswith("我想"):
-            response = gemini_service.get_drink_recommendations(text)
-        elif "的" in text and not text.startswith("比較"):  # 檢查是否為飲料查詢格式
-            response = handle_drink_search(text)
-        else:
-            # 假設是店家選擇
-            response = handle_store_selection(user_id, text)
+        response = route_message(user_id, text)
         
         # 回傳訊息
         if isinstance(response, (ImagemapSendMessage, ImageSendMessage)):
-            line_bot_api.reply_message(
-                event.reply_token,
-                response
-            )
+            _reply(event, response)
         else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=response)
-            )
+            _reply(event, TextSendMessage(text=response))
 
 @handler.add(MessageEvent, message=LocationMessage)
 def handle_location(event):
@@ -448,18 +613,17 @@ def handle_location(event):
     
     try:
         # 取得使用者選擇的店家
-        brand = user_states[user_id].get('brand')
+        brand = state_store.get(user_id).get('brand')
         if not brand:
             response = "請先幫我選擇飲料店～🧋\n（五十嵐、清心福全、麻古茶坊）"
         else:
             # 搜尋附近的店家
-            stores = store_service.search_nearby_stores(brand, (latitude, longitude))
+            stores = get_store_service().search_nearby_stores(brand, (latitude, longitude))
             if not stores:
                 response = "找不到附近的店家，請重新選擇位置"
             else:
                 # 更新使用者狀態
-                user_states[user_id]['stores'] = stores
-                user_states[user_id]['state'] = 'waiting_for_store_selection'
+                state_store.update(user_id, stores=stores, state='waiting_for_store_selection')
                 
                 # 生成店家列表訊息
                 response = "以下是我找到的店家👉🏻\n請選擇一間😊\n\n"
@@ -471,10 +635,7 @@ def handle_location(event):
     except Exception as e:
         response = f"處理位置資訊時發生錯誤：{str(e)}"
     
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=response)
-    )
+    _reply(event, TextSendMessage(text=response))
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
@@ -483,13 +644,13 @@ def handle_postback(event):
     
     if data == 'action=location':
         # 回傳位置按鈕
-        line_bot_api.reply_message(
-            event.reply_token,
-            LocationSendMessage(
-                title='選擇位置',
-                address='請選擇您的位置'
-            )
-        )
+        _reply(event, LocationSendMessage(
+            title='選擇位置',
+            address='請選擇您的位置'
+        ))
+
+startup_report.record('import app.api.webhook（總計）', time.perf_counter() - _module_start, _module_start)
+print(startup_report.summary())
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8080) 
\ No newline at end of file
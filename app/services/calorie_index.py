@@ -0,0 +1,114 @@
+import heapq
+import threading
+from itertools import islice
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.drink_catalog import Drink, DrinkCatalog, get_drink_catalog
+
+# 索引鍵：(品牌, 類型)，None 表示不限
+IndexKey = Tuple[Optional[str], Optional[str]]
+
+
+def describe_filter(brand: Optional[str] = None, drink_types: Optional[Sequence[str]] = None,
+                    min_calories: Optional[int] = None, max_calories: Optional[int] = None) -> List[str]:
+    """
+    將查詢條件轉為文字片段，例如 ['清心福全', '奶茶類', '200 大卡以下']
+    """
+    parts = []
+    if brand:
+        parts.append(brand)
+    if drink_types:
+        parts.append('、'.join(drink_types) + '類')
+    if min_calories is not None:
+        parts.append(f"{min_calories} 大卡以上")
+    if max_calories is not None:
+        parts.append(f"{max_calories} 大卡以下")
+    return parts
+
+
+class CalorieIndex:
+    """
+    依 (品牌, 類型) 分組、依熱量排序的飲料索引：熱量範圍與前 k 名查詢以二分搜尋定位，不需掃描整個目錄
+    """
+
+    def __init__(self, catalog: DrinkCatalog):
+        self.version = catalog.version
+        groups: Dict[IndexKey, List[Drink]] = {}
+        for drink in catalog.drinks:
+            for key in ((None, None), (drink.brand, None), (None, drink.type), (drink.brand, drink.type)):
+                groups.setdefault(key, []).append(drink)
+
+        self._drinks: Dict[IndexKey, List[Drink]] = {}
+        self._calories = {}
+        for key, drinks in groups.items():
+            # 穩定排序：熱量相同時保留 CSV 原始順序
+            drinks.sort(key=lambda d: d.calories)
+            self._drinks[key] = drinks
+            self._calories[key] = np.array([d.calories for d in drinks], dtype=np.int64)
+
+    def _bounds(self, key: IndexKey, min_calories: Optional[int], max_calories: Optional[int]) -> Tuple[int, int]:
+        """
+        取得熱量介於 [min_calories, max_calories] 的飲料在排序清單中的範圍
+        """
+        calories = self._calories.get(key)
+        if calories is None:
+            return 0, 0
+        start = int(calories.searchsorted(min_calories, side='left')) if min_calories is not None else 0
+        end = int(calories.searchsorted(max_calories, side='right')) if max_calories is not None else len(calories)
+        return start, max(start, end)
+
+    def count(self, brand: Optional[str] = None, drink_types: Optional[Sequence[str]] = None,
+              min_calories: Optional[int] = None, max_calories: Optional[int] = None) -> int:
+        """
+        計算符合條件的飲料數量
+        """
+        total = 0
+        for drink_type in drink_types or [None]:
+            start, end = self._bounds((brand, drink_type), min_calories, max_calories)
+            total += end - start
+        return total
+
+    def query(self, brand: Optional[str] = None, drink_types: Optional[Sequence[str]] = None,
+              min_calories: Optional[int] = None, max_calories: Optional[int] = None,
+              k: Optional[int] = None, descending: bool = False) -> List[Drink]:
+        """
+        取得符合條件的飲料，依熱量排序
+        :param drink_types: 多個類型時合併各類型的結果
+        :param k: 只取前 k 筆（None 表示全部）
+        :param descending: True 時由高到低
+        """
+        ranges = []
+        for drink_type in drink_types or [None]:
+            key = (brand, drink_type)
+            start, end = self._bounds(key, min_calories, max_calories)
+            if k is not None:
+                if descending:
+                    start = max(start, end - k)
+                else:
+                    end = min(end, start + k)
+            selected = self._drinks.get(key, [])[start:end]
+            ranges.append(selected[::-1] if descending else selected)
+
+        if len(ranges) == 1:
+            return ranges[0]
+        merged = heapq.merge(*ranges, key=lambda d: d.calories, reverse=descending)
+        return list(islice(merged, k))
+
+
+_calorie_index: Optional[CalorieIndex] = None
+_calorie_index_lock = threading.Lock()
+
+
+def get_calorie_index() -> CalorieIndex:
+    """
+    取得全程序共用的熱量索引，目錄版本變動時自動重建
+    """
+    global _calorie_index
+    catalog = get_drink_catalog()
+    if _calorie_index is None or _calorie_index.version != catalog.version:
+        with _calorie_index_lock:
+            if _calorie_index is None or _calorie_index.version != catalog.version:
+                _calorie_index = CalorieIndex(catalog)
+    return _calorie_index
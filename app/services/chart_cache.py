@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from app.services.paths import PROJECT_ROOT
+
+# 圖表輸出目錄（位於 static 底下，由 /static/charts/<檔名> 提供）
+CHART_DIR = os.getenv('CHART_CACHE_DIR', os.path.join(PROJECT_ROOT, 'static', 'charts'))
+CHART_URL_PREFIX = 'charts'
+
+# 圖表快取佔用的磁碟空間上限（位元組），超過時刪除最久未使用的圖表
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+
+def chart_key(user_id: str, start_date: str, end_date: str, data: Dict) -> str:
+    """
+    以 (使用者, 日期區間, 資料內容) 產生圖表編號；資料有變動時編號也會改變
+    """
+    text = json.dumps([user_id, start_date, end_date, data], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ChartCache:
+    """
+    以內容雜湊命名的圖表快取：相同的圖表直接重用，並以 LRU 控制磁碟用量
+
+    每張圖表有兩個檔案：<編號>.png（原圖）與 <編號>-preview.png（預覽圖）。
+    檔案的修改時間即為最近使用時間。
+    """
+
+    def __init__(self, directory: str = CHART_DIR, max_bytes: int = CHART_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        return (
+            os.path.join(self.directory, f"{key}.png"),
+            os.path.join(self.directory, f"{key}-preview.png")
+        )
+
+    @staticmethod
+    def _urls(key: str) -> Tuple[str, str]:
+        return f"{CHART_URL_PREFIX}/{key}.png", f"{CHART_URL_PREFIX}/{key}-preview.png"
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """
+        取得已產生的圖表，回傳 (原圖路徑, 預覽圖路徑)（相對於 static 目錄）
+        """
+        paths = self._paths(key)
+        try:
+            for path in paths:
+                # 更新修改時間，標記為最近使用
+                os.utime(path)
+        except OSError:
+            return None
+        self.hits += 1
+        return self._urls(key)
+
+    def get_or_render(self, key: str, render: Callable[[str, str], None]) -> Tuple[str, str]:
+        """
+        取得圖表，沒有快取時呼叫 render(原圖路徑, 預覽圖路徑) 產生
+        render 需以暫存檔改名的方式寫入，原圖最後寫入
+        """
+        cached = self.get(key)
+        if cached:
+            return cached
+
+        self.misses += 1
+        render(*self._paths(key))
+        self.evict(keep=key)
+        return self._urls(key)
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        磁碟用量超過上限時，刪除最久未使用的圖表
+        """
+        with self._lock:
+            charts: Dict[str, Dict] = {}
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.png') or '.tmp' in entry.name:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                key = entry.name[:-len('.png')].replace('-preview', '')
+                chart = charts.setdefault(key, {"size": 0, "used_at": 0.0, "paths": []})
+                chart["size"] += stat.st_size
+                chart["used_at"] = max(chart["used_at"], stat.st_mtime)
+                chart["paths"].append(entry.path)
+
+            total = sum(chart["size"] for chart in charts.values())
+            for key, chart in sorted(charts.items(), key=lambda item: item[1]["used_at"]):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                for path in chart["paths"]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= chart["size"]
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_chart_cache: Optional[ChartCache] = None
+_chart_cache_lock = threading.Lock()
+
+
+def get_chart_cache() -> ChartCache:
+    """
+    取得全程序共用的圖表快取
+    """
+    global _chart_cache
+    if _chart_cache is None:
+        with _chart_cache_lock:
+            if _chart_cache is None:
+                _chart_cache = ChartCache()
+    return _chart_cache
@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+# 繪圖程序數量與每張圖表的最長等待時間（秒）
+CHART_RENDER_WORKERS = int(os.getenv('CHART_RENDER_WORKERS', '2'))
+CHART_RENDER_TIMEOUT = float(os.getenv('CHART_RENDER_TIMEOUT', '5'))
+
+# 圖表解析度：原圖供使用者點開查看，預覽圖顯示在聊天室中
+CHART_DPI = 150
+CHART_PREVIEW_DPI = 40
+
+# 品牌名稱對應（圖表使用英文字型，避免中文缺字）
+BRAND_LABELS = {
+    '五十嵐': 'FIFTYLAN',
+    '清心福全': 'QING XIN FU QUAN',
+    '麻古茶坊': 'MACU TEA'
+}
+
+
+class ChartRenderTimeout(Exception):
+    """
+    圖表未在期限內完成（繪圖程序仍會在背景完成並寫入快取）
+    """
+
+
+def _init_worker():
+    # 在繪圖程序啟動時載入 matplotlib 並畫一張小圖，讓字型快取在第一次請求前就緒
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(1, 1))
+    fig.add_subplot().set_title('warm up')
+    fig.canvas.draw()
+
+
+def _save_figure(fig, path: str, dpi: int):
+    # 先寫入暫存檔再改名，避免 LINE 讀到寫到一半的圖片
+    tmp_path = f"{path}.{os.getpid()}.tmp.png"
+    try:
+        fig.savefig(tmp_path, dpi=dpi, bbox_inches='tight')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def render_statistics_chart(stats: Dict, full_path: str, preview_path: str):
+    """
+    依統計資料繪製圖表，輸出原圖與預覽圖（在繪圖程序中執行）
+    """
+    # 使用物件導向的 Figure API，不依賴 pyplot 的全域狀態
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(15, 6))
+    ax1, ax2 = fig.subplots(1, 2)
+
+    # 1. 品牌圓餅圖
+    # 轉換品牌名稱為英文（彙總已依杯數多到少排序）
+    labels = [BRAND_LABELS.get(brand, brand) for brand in stats['brands']]
+    colors = ['#FF9999', '#66B2FF', '#99FF99']  # 設定顏色
+    ax1.pie(list(stats['brands'].values()), labels=labels, autopct='%1.1f%%', colors=colors)
+    ax1.set_title('Drink Brand Distribution', pad=20, fontsize=12)
+
+    # 2. 每日飲料數量長條圖
+    # 將日期轉換為 YYYY/MM/DD 格式
+    dates = [day['date'].replace('-', '/') for day in stats['daily']]
+    counts = [day['count'] for day in stats['daily']]
+
+    ax2.bar(dates, counts, color='#66B2FF')
+    ax2.set_title('Daily Drink Count', pad=20, fontsize=12)
+    ax2.set_xlabel('Date', fontsize=10)
+    ax2.set_ylabel('Count', fontsize=10)
+    ax2.tick_params(axis='x', labelrotation=45)
+
+    # 調整布局
+    fig.tight_layout()
+
+    # 預覽圖先寫入，原圖最後寫入：原圖存在即代表兩張圖都已完成
+    _save_figure(fig, preview_path, CHART_PREVIEW_DPI)
+    _save_figure(fig, full_path, CHART_DPI)
+
+
+class ChartRenderer:
+    """
+    圖表繪製程序池：matplotlib 不是執行緒安全的，且繪圖很耗 CPU，
+    因此在獨立的程序中繪製，不佔用 webhook 的執行緒
+    """
+
+    def __init__(self, workers: int = CHART_RENDER_WORKERS, timeout: float = CHART_RENDER_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.renders = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.total_ms = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # 使用 spawn 建立乾淨的程序，避免從多執行緒的 webhook 程序 fork
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker
+                    )
+        return self._executor
+
+    def render(self, stats: Dict, full_path: str, preview_path: str):
+        """
+        在繪圖程序中繪製圖表，超過期限時拋出 ChartRenderTimeout
+        """
+        start = time.perf_counter()
+        try:
+            future = self._get_executor().submit(render_statistics_chart, stats, full_path, preview_path)
+        except BrokenProcessPool:
+            # 繪圖程序異常結束，重新建立程序池
+            with self._lock:
+                self._executor = None
+            future = self._get_executor().submit(render_statistics_chart, stats, full_path, preview_path)
+
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            raise ChartRenderTimeout(f"圖表未在 {self.timeout:.0f} 秒內完成") from None
+        except Exception:
+            self.failures += 1
+            raise
+        self.renders += 1
+        self.total_ms += (time.perf_counter() - start) * 1000
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "renders": self.renders,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "avg_ms": round(self.total_ms / self.renders, 2) if self.renders else 0.0
+        }
+
+
+_chart_renderer: Optional[ChartRenderer] = None
+_chart_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer() -> ChartRenderer:
+    """
+    取得全程序共用的圖表繪製程序池
+    """
+    global _chart_renderer
+    if _chart_renderer is None:
+        with _chart_renderer_lock:
+            if _chart_renderer is None:
+                _chart_renderer = ChartRenderer()
+    return _chart_renderer
@@ -0,0 +1,127 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.paths import DATA_DIR
+
+# 預設的飲料資料檔
+DEFAULT_CSV_PATH = os.path.join(DATA_DIR, 'drink_data.csv')
+
+# 品牌名稱對應關係（正式名稱 -> 常見別名）
+BRAND_ALIASES = {
+    '五十嵐': ['50嵐'],
+    '清心福全': ['清心福全', '清心'],
+    '麻古茶坊': ['麻古茶坊', '麻古', '麻古茶坊 MACU TEA']
+}
+
+# 飲料的常見簡稱（正式名稱 -> 簡稱），只套用在有該飲料的品牌
+DRINK_ALIASES = {
+    '珍珠奶茶': ['珍奶'],
+    '珍珠奶綠': ['珍奶綠'],
+    '波霸奶茶': ['波奶'],
+    '波霸奶綠': ['波奶綠'],
+    '布丁奶茶': ['布奶'],
+}
+
+
+class Drink(NamedTuple):
+    brand: str
+    drink_name: str
+    type: str
+    calories: int
+
+
+class DrinkCatalog:
+    """
+    飲料目錄：整個程序只載入一次 CSV，並預先建立查詢索引
+    """
+
+    def __init__(self, csv_path: str = DEFAULT_CSV_PATH):
+        self.csv_path = csv_path
+        self.load()
+
+    def load(self):
+        """
+        讀取 CSV 並重建所有索引
+        """
+        with open(self.csv_path, 'rb') as f:
+            raw = f.read()
+
+        # 使用標準函式庫解析
+        reader = csv.DictReader(io.StringIO(raw.decode('utf-8-sig')))
+        drinks = [
+            Drink(row['brand'], row['drink_name'], row['type'], int(row['calories']))
+            for row in reader
+        ]
+
+        by_key: Dict[Tuple[str, str], Drink] = {}
+        by_brand: Dict[str, List[Drink]] = {}
+        by_name: Dict[str, List[Drink]] = {}
+        for drink in drinks:
+            # 同一品牌同名飲料以第一筆為準（與原本 iloc[0] 行為一致）
+            by_key.setdefault((drink.brand, drink.drink_name), drink)
+            by_brand.setdefault(drink.brand, []).append(drink)
+            by_name.setdefault(drink.drink_name, []).append(drink)
+
+        # 以內容雜湊作為版本號，供快取判斷資料是否變動
+        self.version = hashlib.sha1(raw).hexdigest()[:12]
+        self.drinks = drinks
+        self._by_key = by_key
+        self._by_brand = by_brand
+        self._by_name = by_name
+
+    @property
+    def brands(self) -> List[str]:
+        return list(self._by_brand)
+
+    def get(self, brand: str, drink_name: str) -> Optional[Drink]:
+        """
+        依 (品牌, 飲料名稱) 取得飲料，找不到時回傳 None
+        """
+        return self._by_key.get((brand, drink_name))
+
+    def get_calories(self, brand: str, drink_name: str) -> Optional[int]:
+        drink = self.get(brand, drink_name)
+        return drink.calories if drink else None
+
+    def get_brand_drinks(self, brand: str) -> List[Drink]:
+        """
+        取得某品牌的所有飲料（依 CSV 原始順序）
+        """
+        return self._by_brand.get(brand, [])
+
+    def get_name_drinks(self, drink_name: str) -> List[Drink]:
+        """
+        取得所有品牌中同名的飲料
+        """
+        return self._by_name.get(drink_name, [])
+
+    def get_similar(self, brand: str, drink_name: str) -> List[Drink]:
+        """
+        取得同品牌或同名稱的飲料（找不到完全匹配時的候選清單）
+        """
+        similar = list(self.get_brand_drinks(brand))
+        similar.extend(d for d in self.get_name_drinks(drink_name) if d.brand != brand)
+        return similar
+
+    def __len__(self) -> int:
+        return len(self.drinks)
+
+
+_catalog: Optional[DrinkCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_drink_catalog() -> DrinkCatalog:
+    """
+    取得全程序共用的飲料目錄（第一次呼叫時才載入）
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = DrinkCatalog()
+    return _catalog
@@ -0,0 +1,245 @@
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.calorie_index import describe_filter, get_calorie_index
+from app.services.drink_catalog import Drink, DrinkCatalog, get_drink_catalog
+from app.services.entity_extractor import AhoCorasick, ParsedMessage, get_entity_extractor
+from app.services.fuzzy_matcher import normalize
+
+# 本地推薦回覆的飲料數量，以及使用者指定筆數（例如「前5名」）的上限
+RECOMMENDATION_COUNT = 3
+MAX_LIMIT = 10
+
+# 飲料類型的說法（目錄中的 type -> 使用者常用的字詞）
+TYPE_KEYWORDS = {
+    '茶': ['茶', '茶類', '純茶'],
+    '奶茶': ['奶茶'],
+    '珍珠': ['珍珠', '波霸', '粉圓'],
+    '拿鐵': ['拿鐵', 'latte'],
+    '鮮奶': ['鮮奶', '牛奶'],
+    '果汁': ['果汁', '果茶', '水果'],
+    '布丁': ['布丁'],
+    '仙草': ['仙草'],
+}
+
+# 熱量偏好的說法
+LOW_CALORIE_KEYWORDS = ['低熱量', '低卡', '熱量低', '熱量較低', '熱量最低', '最低熱量', '不胖', '不會胖', '減肥', '瘦身']
+HIGH_CALORIE_KEYWORDS = ['高熱量', '高卡', '熱量高', '熱量較高', '熱量最高', '最高熱量']
+
+# 不影響條件的字詞；去掉條件與這些字詞後仍有剩餘文字時，視為開放式需求交給 Gemini
+IGNORED_KEYWORDS = [
+    '想要', '我想', '我要', '要', '想', '喝', '來', '一杯', '杯', '推薦', '給我', '請', '有', '加',
+    '的', '飲料', '飲品', '類', '點', '一點', '一些', '熱量', '大卡', '卡路里', '卡', '比較', '嗎', '呢',
+]
+
+# 熱量上下限，例如「300大卡以下」、「低於300卡」、「100到200大卡」
+_CALORIE_UNIT = r'(?:大卡|卡路里|卡|kcal)?'
+_CALORIE_BETWEEN = re.compile(r'(\d+)' + _CALORIE_UNIT + r'(?:到|至|~|-)(\d+)(?:大卡|卡路里|卡|kcal)')
+_CALORIE_SUFFIX = re.compile(r'(\d+)' + _CALORIE_UNIT + r'(以下|以內|以上)')
+_CALORIE_PREFIX = re.compile(r'(低於|少於|小於|不超過|高於|大於|超過)(\d+)' + _CALORIE_UNIT)
+_MAX_WORDS = ('以下', '以內', '低於', '少於', '小於', '不超過')
+
+# 筆數，例如「前5名」、「top5」、「5杯」
+_LIMIT_PREFIX = re.compile(r'(?:前|top)(\d+)(?:名|杯|款|個|種)?')
+_LIMIT_SUFFIX = re.compile(r'(\d+)(?:杯|款|個|種)')
+
+_PUNCTUATION = re.compile(r'[\s,.!?~，。！？～、…]+')
+
+
+def _uncovered_segments(text: str, covered: List[bool]) -> List[Tuple[int, str]]:
+    """
+    取得尚未被比對到的連續文字片段：(起點, 片段)
+    """
+    segments, start = [], None
+    for i, done in enumerate(covered + [True]):
+        if not done and start is None:
+            start = i
+        elif done and start is not None:
+            segments.append((start, text[start:i]))
+            start = None
+    return segments
+
+
+class Constraints(NamedTuple):
+    brand: Optional[str]
+    types: List[str]
+    drink_names: List[str]
+    min_calories: Optional[int]
+    max_calories: Optional[int]
+    order: Optional[str]  # 'low'、'high' 或 None（未指定時由低到高）
+    limit: Optional[int]  # 要求的筆數，例如「前5名」
+
+    @property
+    def is_calorie_query(self) -> bool:
+        """
+        是否為熱量範圍或熱量排名的查詢（沒有指定飲料名稱）
+        """
+        has_calorie = self.order or self.min_calories is not None or self.max_calories is not None
+        return bool(has_calorie) and not self.drink_names
+
+    def describe(self) -> str:
+        parts = describe_filter(self.brand, self.types, self.min_calories, self.max_calories)
+        if self.drink_names:
+            parts.insert(1 if self.brand else 0, '、'.join(self.drink_names))
+        if self.order == 'low':
+            parts.append('熱量低')
+        elif self.order == 'high':
+            parts.append('熱量高')
+        return '，'.join(parts)
+
+
+class DrinkRecommender:
+    """
+    規則式飲料推薦：解析需求中的品牌、類型與熱量條件，以預先依熱量排序的索引直接回答
+    """
+
+    def __init__(self, catalog: DrinkCatalog):
+        self.catalog = catalog
+        self.version = catalog.version
+
+        self.automaton = AhoCorasick()
+        # 與類型同名的飲料（例如「奶茶」）視為類型
+        self._type_by_keyword: Dict[str, str] = {}
+        for drink_type, keywords in TYPE_KEYWORDS.items():
+            for keyword in keywords:
+                self.automaton.add(normalize(keyword), ('type', drink_type))
+                self._type_by_keyword[normalize(keyword)] = drink_type
+        for keyword in LOW_CALORIE_KEYWORDS:
+            self.automaton.add(normalize(keyword), ('order', 'low'))
+        for keyword in HIGH_CALORIE_KEYWORDS:
+            self.automaton.add(normalize(keyword), ('order', 'high'))
+        for keyword in IGNORED_KEYWORDS:
+            self.automaton.add(normalize(keyword), ('ignored', keyword))
+        self.automaton.build()
+
+        self.answered = 0
+        self.escalated = 0
+
+    def parse(self, text: str, parsed: Optional[ParsedMessage] = None) -> Optional[Constraints]:
+        """
+        解析需求中的條件；有無法解析的文字（開放式需求）或沒有任何條件時回傳 None
+        :param parsed: 已由實體擷取器解析過的訊息（省略時重新解析）
+        """
+        parsed = parsed or get_entity_extractor().parse(text)
+        text = parsed.text
+        covered = [False] * len(text)
+
+        def cover(start: int, end: int):
+            for i in range(start, end):
+                covered[i] = True
+
+        brand = parsed.brands[0] if parsed.brands else None
+        if len(set(parsed.brands)) > 1:
+            return None
+        types, drink_names, order = [], [], None
+        for mention in parsed.mentions:
+            if mention.kind == 'drink':
+                drink_type = self._type_by_keyword.get(normalize(mention.value))
+                if drink_type and drink_type not in types:
+                    types.append(drink_type)
+                elif not drink_type and mention.value not in drink_names:
+                    drink_names.append(mention.value)
+            cover(mention.start, mention.end)
+
+        # 只在品牌與飲料名稱以外的文字中找類型與熱量條件（「麻古茶坊」、「蜜茶」中的「茶」不是類型）
+        for offset, segment in _uncovered_segments(text, covered):
+            for start, end, (kind, value) in self.automaton.longest_matches(segment):
+                if kind == 'type' and value not in types:
+                    types.append(value)
+                elif kind == 'order':
+                    order = value
+                cover(offset + start, offset + end)
+
+        min_calories = max_calories = None
+        for match in _CALORIE_BETWEEN.finditer(text):
+            low, high = sorted((int(match.group(1)), int(match.group(2))))
+            min_calories, max_calories = low, high
+            cover(*match.span())
+        for match in _CALORIE_SUFFIX.finditer(text):
+            if match.group(2) in _MAX_WORDS:
+                max_calories = int(match.group(1))
+            else:
+                min_calories = int(match.group(1))
+            cover(*match.span())
+        for match in _CALORIE_PREFIX.finditer(text):
+            if match.group(1) in _MAX_WORDS:
+                max_calories = int(match.group(2))
+            else:
+                min_calories = int(match.group(2))
+            cover(*match.span())
+
+        limit = None
+        for pattern in (_LIMIT_PREFIX, _LIMIT_SUFFIX):
+            for match in pattern.finditer(text):
+                if not any(covered[match.start(1):match.end(1)]):
+                    limit = min(int(match.group(1)), MAX_LIMIT) or None
+                    cover(*match.span())
+
+        leftover = ''.join(ch for ch, done in zip(text, covered) if not done)
+        if _PUNCTUATION.sub('', leftover):
+            return None
+        constraints = Constraints(brand, types, drink_names, min_calories, max_calories, order, limit)
+        if not (brand or types or drink_names or order or min_calories is not None or max_calories is not None):
+            return None
+        return constraints
+
+    def search(self, constraints: Constraints) -> List[Drink]:
+        """
+        取得符合條件的飲料，依熱量排序（order 為 'high' 時由高到低）
+        """
+        k = constraints.limit or RECOMMENDATION_COUNT
+        descending = constraints.order == 'high'
+
+        if constraints.drink_names:
+            low = constraints.min_calories if constraints.min_calories is not None else float('-inf')
+            high = constraints.max_calories if constraints.max_calories is not None else float('inf')
+            drinks = [
+                d for name in constraints.drink_names for d in self.catalog.get_name_drinks(name)
+                if (constraints.brand is None or d.brand == constraints.brand)
+                and (not constraints.types or d.type in constraints.types)
+                and low <= d.calories <= high
+            ]
+            return sorted(drinks, key=lambda d: d.calories, reverse=descending)[:k]
+
+        return get_calorie_index().query(
+            constraints.brand, constraints.types, constraints.min_calories, constraints.max_calories,
+            k=k, descending=descending
+        )
+
+    def recommend(self, user_input: str) -> Optional[str]:
+        """
+        條件明確的需求直接回覆推薦；開放式需求或找不到符合的飲料時回傳 None（交給 Gemini）
+        """
+        constraints = self.parse(user_input)
+        drinks = self.search(constraints) if constraints else []
+        if not drinks:
+            self.escalated += 1
+            return None
+
+        self.answered += 1
+        lines = [
+            f"{i}. {drink.brand} {drink.drink_name}（{drink.type}，{drink.calories} 大卡）"
+            for i, drink in enumerate(drinks, 1)
+        ]
+        return f"依照您的需求（{constraints.describe()}），推薦以下飲料：\n\n" + "\n".join(lines)
+
+    def stats(self) -> Dict[str, int]:
+        return {"answered": self.answered, "escalated": self.escalated}
+
+
+_recommender: Optional[DrinkRecommender] = None
+_recommender_lock = threading.Lock()
+
+
+def get_drink_recommender() -> DrinkRecommender:
+    """
+    取得全程序共用的規則式推薦，目錄版本變動時自動重建
+    """
+    global _recommender
+    catalog = get_drink_catalog()
+    if _recommender is None or _recommender.version != catalog.version:
+        with _recommender_lock:
+            if _recommender is None or _recommender.version != catalog.version:
+                _recommender = DrinkRecommender(catalog)
+    return _recommender
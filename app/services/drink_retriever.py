@@ -0,0 +1,190 @@
+import math
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from app.services.drink_catalog import BRAND_ALIASES, Drink, DrinkCatalog, get_drink_catalog
+from app.services.fuzzy_matcher import char_ngrams, normalize
+
+# BM25 參數
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 推薦需求中常見、但對檢索沒有幫助的字詞
+FILLER_WORDS = ['想要', '我想', '推薦', '一杯', '飲料', '喝', '的', '有', '點']
+
+_MAX_PATTERNS = [
+    re.compile(r'(\d+)\s*(?:大卡|卡|kcal)?\s*(?:以下|以內|之內|內)'),
+    re.compile(r'(?:低於|少於|小於|不超過|不要超過|<=?)\s*(\d+)'),
+]
+_MIN_PATTERNS = [
+    re.compile(r'(\d+)\s*(?:大卡|卡|kcal)?\s*以上'),
+    re.compile(r'(?:高於|多於|大於|超過|>=?)\s*(\d+)'),
+]
+_LOW_CALORIE_WORDS = ['低熱量', '低卡', '熱量低', '低糖', '減肥', '減脂', '清爽']
+_CALORIE_PHRASE = re.compile(
+    r'\d+\s*(?:大卡|卡|kcal)?\s*(?:以下|以內|之內|內|以上)'
+    r'|(?:低於|少於|小於|不超過|不要超過|高於|多於|大於|超過|<=?|>=?)\s*\d+\s*(?:大卡|卡|kcal)?'
+)
+
+
+class CalorieConstraint(NamedTuple):
+    min_calories: Optional[int]
+    max_calories: Optional[int]
+    prefer_low: bool
+
+
+def parse_calorie_constraint(text: str) -> CalorieConstraint:
+    """
+    從使用者需求解析熱量條件，例如「300大卡以下」、「低熱量」
+    """
+    text = normalize(text)
+    max_calories = min_calories = None
+    for pattern in _MAX_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            max_calories = int(match.group(1))
+            break
+    for pattern in _MIN_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            min_calories = int(match.group(1))
+            break
+    prefer_low = max_calories is not None or any(word in text for word in _LOW_CALORIE_WORDS)
+    return CalorieConstraint(min_calories, max_calories, prefer_low)
+
+
+def _query_terms(text: str) -> List[str]:
+    text = _CALORIE_PHRASE.sub(' ', normalize(text))
+    for word in _LOW_CALORIE_WORDS + FILLER_WORDS:
+        text = text.replace(word, ' ')
+    terms = set()
+    for chunk in text.split():
+        terms.update(char_ngrams(chunk))
+    return sorted(terms)
+
+
+class DrinkRetriever:
+    """
+    飲料檢索器：以 BM25 挑出與需求最相關的飲料，只把這些飲料放進提示
+    """
+
+    def __init__(self, catalog: DrinkCatalog, brand_aliases: Dict[str, List[str]] = BRAND_ALIASES):
+        self.version = catalog.version
+        self.drinks = catalog.drinks
+
+        # 每款飲料的文件：品牌（含別名）、飲料名稱與類型
+        postings: Dict[str, List[tuple]] = {}
+        lengths = []
+        for doc_id, drink in enumerate(self.drinks):
+            fields = [drink.brand, drink.drink_name, drink.type] + list(brand_aliases.get(drink.brand, []))
+            terms: Dict[str, int] = {}
+            for field in fields:
+                for term in char_ngrams(normalize(field)):
+                    terms[term] = terms.get(term, 0) + 1
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+            lengths.append(sum(terms.values()))
+
+        total = len(self.drinks) or 1
+        self._postings = postings
+        self._lengths = lengths
+        self._avg_length = (sum(lengths) / total) or 1
+        self._idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+        # 依熱量排序的名次（0 為最低），用於「低熱量」需求
+        self._calorie_order = sorted(range(len(self.drinks)), key=lambda i: self.drinks[i].calories)
+        self._calorie_rank = [0.0] * len(self.drinks)
+        for rank, doc_id in enumerate(self._calorie_order):
+            self._calorie_rank[doc_id] = rank / total
+
+        # 需求不明確時的預設候選：輪流從各品牌、各類型各取一款
+        self._default_order = self._round_robin()
+
+    def _round_robin(self) -> List[int]:
+        by_group: Dict[tuple, List[int]] = {}
+        for doc_id, drink in enumerate(self.drinks):
+            by_group.setdefault((drink.brand, drink.type), []).append(doc_id)
+        groups = list(by_group.values())
+        order = []
+        depth = 0
+        while len(order) < len(self.drinks):
+            for group in groups:
+                if depth < len(group):
+                    order.append(group[depth])
+            depth += 1
+        return order
+
+    def _bm25(self, terms: List[str]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in terms:
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = self._idf[term]
+            for doc_id, tf in docs:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def retrieve(self, user_input: str, k: int = 20) -> List[Drink]:
+        """
+        取得與使用者需求最相關的 k 款飲料
+        """
+        constraint = parse_calorie_constraint(user_input)
+
+        def allowed(doc_id: int) -> bool:
+            calories = self.drinks[doc_id].calories
+            if constraint.max_calories is not None and calories > constraint.max_calories:
+                return False
+            if constraint.min_calories is not None and calories < constraint.min_calories:
+                return False
+            return True
+
+        selected = []
+        scores = self._bm25(_query_terms(user_input))
+        if scores:
+            best = max(scores.values())
+            ranked = []
+            for doc_id, score in scores.items():
+                if not allowed(doc_id):
+                    continue
+                value = score / best
+                if constraint.prefer_low:
+                    value += 1 - self._calorie_rank[doc_id]
+                ranked.append((-value, doc_id))
+            ranked.sort()
+            selected = [doc_id for _, doc_id in ranked[:k]]
+
+        # 關鍵字命中不足時，依熱量條件或預設順序補足
+        if len(selected) < k:
+            if constraint.prefer_low or constraint.min_calories is not None:
+                candidates = self._calorie_order
+            else:
+                candidates = self._default_order
+            chosen = set(selected)
+            for doc_id in candidates:
+                if doc_id not in chosen and allowed(doc_id):
+                    selected.append(doc_id)
+                    if len(selected) >= k:
+                        break
+        return [self.drinks[doc_id] for doc_id in selected]
+
+_retriever: Optional[DrinkRetriever] = None
+_retriever_lock = threading.Lock()
+
+
+def get_drink_retriever() -> DrinkRetriever:
+    """
+    取得全程序共用的飲料檢索器，目錄版本變動時自動重建
+    """
+    global _retriever
+    catalog = get_drink_catalog()
+    if _retriever is None or _retriever.version != catalog.version:
+        with _retriever_lock:
+            if _retriever is None or _retriever.version != catalog.version:
+                _retriever = DrinkRetriever(catalog)
+    return _retriever
@@ -1,96 +1,145 @@
-import pandas as pd
-import os
+import threading
+from typing import Optional, Sequence
+
+from app.services.calorie_index import describe_filter, get_calorie_index
+from app.services.drink_catalog import get_drink_catalog
+from app.services.fuzzy_matcher import get_fuzzy_matcher
+from app.services.startup_report import startup_report
+
+# 熱量範圍查詢最多列出的飲料數量，與熱量排名預設的筆數
+CALORIE_RANGE_LIMIT = 10
+TOP_DRINKS_COUNT = 5
 
 class DrinkService:
     def __init__(self):
-        # 使用相對於專案根目錄的路徑
-        current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        csv_path = os.path.join(current_dir, 'data', 'drink_data.csv')
-        self.drinks_df = pd.read_csv(csv_path)
+        # 使用全程序共用的飲料目錄
+        self.catalog = get_drink_catalog()
+        self.matcher = get_fuzzy_matcher()
+    
+    def _similar_drinks(self, brand, drink_name):
+        """
+        取得相似飲料：優先使用模糊比對結果，否則列出同品牌或同名稱的飲料
+        """
+        return (self.matcher.suggest_drinks(brand, drink_name)
+                or self.catalog.get_similar(self.matcher.resolve_brand(brand) or brand, drink_name))
     
     def search_drink(self, brand, drink_name):
         """
         查詢飲料熱量
         """
-        # 搜尋飲料（使用完全匹配）
-        drinks = self.drinks_df[
-            (self.drinks_df['brand'] == brand) &
-            (self.drinks_df['drink_name'] == drink_name)
-        ]
+        # 搜尋飲料（完全相符的名稱或簡稱；相近的飲料只列為候選）
+        drink = self.matcher.resolve_drink(brand, drink_name)
         
-        if drinks.empty:
+        if drink is None:
             # 如果找不到完全匹配，提供可能的選項
-            similar_drinks = self.drinks_df[
-                (self.drinks_df['brand'] == brand) |
-                (self.drinks_df['drink_name'] == drink_name)
-            ]
+            similar_drinks = self._similar_drinks(brand, drink_name)
             
-            if similar_drinks.empty:
+            if not similar_drinks:
                 return "找不到這個飲料，請確認店家名稱和飲料名稱是否正確"
             
             # 生成相似飲料列表
             result = f"找不到完全符合的飲料，以下是相似的飲料：\n\n"
-            for _, drink in similar_drinks.iterrows():
-                result += f"{drink['brand']} {drink['drink_name']}：{drink['calories']} 大卡\n"
+            for similar in similar_drinks:
+                result += f"{similar.brand} {similar.drink_name}：{similar.calories} 大卡\n"
             return result
         
         # 如果找到飲料
-        drink_info = drinks.iloc[0]
-        return f"""{drink_info['brand']} {drink_info['drink_name']}：
-- 熱量：{drink_info['calories']} 大卡"""
+        return f"""{drink.brand} {drink.drink_name}：
+- 熱量：{drink.calories} 大卡"""
     
     def compare_drinks(self, drink1_brand, drink1_name, drink2_brand, drink2_name):
         """
         比較兩款飲料的熱量
         """
-        # 搜尋飲料（使用完全匹配）
-        drink1 = self.drinks_df[
-            (self.drinks_df['brand'] == drink1_brand) &
-            (self.drinks_df['drink_name'] == drink1_name)
-        ]
-        drink2 = self.drinks_df[
-            (self.drinks_df['brand'] == drink2_brand) &
-            (self.drinks_df['drink_name'] == drink2_name)
-        ]
+        # 搜尋飲料（完全相符的名稱或簡稱；相近的飲料只列為候選）
+        drink1 = self.matcher.resolve_drink(drink1_brand, drink1_name)
+        drink2 = self.matcher.resolve_drink(drink2_brand, drink2_name)
         
-        if drink1.empty or drink2.empty:
+        if drink1 is None or drink2 is None:
             # 如果找不到完全匹配，提供可能的選項
-            similar_drinks1 = self.drinks_df[
-                (self.drinks_df['brand'] == drink1_brand) |
-                (self.drinks_df['drink_name'] == drink1_name)
-            ]
-            similar_drinks2 = self.drinks_df[
-                (self.drinks_df['brand'] == drink2_brand) |
-                (self.drinks_df['drink_name'] == drink2_name)
-            ]
+            similar_drinks1 = self._similar_drinks(drink1_brand, drink1_name)
+            similar_drinks2 = self._similar_drinks(drink2_brand, drink2_name)
             
             error_msg = "找不到指定的飲料，請確認店家名稱和飲料名稱是否正確\n\n"
             
-            if not similar_drinks1.empty:
+            if similar_drinks1:
                 error_msg += f"在 {drink1_brand} 找到的相似飲料：\n"
-                for _, drink in similar_drinks1.iterrows():
-                    error_msg += f"- {drink['drink_name']}\n"
+                for drink in similar_drinks1:
+                    error_msg += f"- {drink.drink_name}\n"
             
-            if not similar_drinks2.empty:
+            if similar_drinks2:
                 error_msg += f"\n在 {drink2_brand} 找到的相似飲料：\n"
-                for _, drink in similar_drinks2.iterrows():
-                    error_msg += f"- {drink['drink_name']}\n"
+                for drink in similar_drinks2:
+                    error_msg += f"- {drink.drink_name}\n"
             
             return error_msg
         
-        # 取得飲料資訊
-        drink1_info = drink1.iloc[0]
-        drink2_info = drink2.iloc[0]
-        
         # 計算熱量差異
-        calorie_diff = abs(drink1_info['calories'] - drink2_info['calories'])
+        calorie_diff = abs(drink1.calories - drink2.calories)
         
         # 生成比較結果
-        result = f"""{drink1_info['brand']} {drink1_info['drink_name']}：
-- 熱量：{drink1_info['calories']} 大卡
+        result = f"""{drink1.brand} {drink1.drink_name}：
+- 熱量：{drink1.calories} 大卡
 
-{drink2_info['brand']} {drink2_info['drink_name']}：
-- 熱量：{drink2_info['calories']} 大卡
+{drink2.brand} {drink2.drink_name}：
+- 熱量：{drink2.calories} 大卡
 
 熱量差異：{calorie_diff} 大卡"""
-        return result 
\ No newline at end of file
+        return result
+    
+    def search_calorie_range(self, min_calories: Optional[int] = None, max_calories: Optional[int] = None,
+                             brand: Optional[str] = None, drink_types: Optional[Sequence[str]] = None,
+                             limit: int = CALORIE_RANGE_LIMIT) -> str:
+        """
+        查詢熱量介於指定範圍的飲料（依熱量由低到高列出）
+        :param drink_types: 飲料類型（例如 ['茶', '奶茶']），None 表示不限
+        """
+        index = get_calorie_index()
+        total = index.count(brand, drink_types, min_calories, max_calories)
+        condition = '，'.join(describe_filter(brand, drink_types, min_calories, max_calories)) or '全部'
+        if total == 0:
+            return f"找不到符合條件（{condition}）的飲料"
+        
+        drinks = index.query(brand, drink_types, min_calories, max_calories, k=limit)
+        result = f"符合條件（{condition}）的飲料共 {total} 款，依熱量由低到高：\n\n"
+        for drink in drinks:
+            result += f"{drink.brand} {drink.drink_name}：{drink.calories} 大卡\n"
+        if total > len(drinks):
+            result += f"\n…還有 {total - len(drinks)} 款，可加上店家或類型縮小範圍"
+        return result
+    
+    def get_top_drinks(self, k: int = TOP_DRINKS_COUNT, brand: Optional[str] = None,
+                       drink_types: Optional[Sequence[str]] = None, lightest: bool = True,
+                       min_calories: Optional[int] = None, max_calories: Optional[int] = None) -> str:
+        """
+        查詢熱量最低（或最高）的前 k 款飲料
+        """
+        drinks = get_calorie_index().query(
+            brand, drink_types, min_calories, max_calories, k=k, descending=not lightest
+        )
+        condition = '，'.join(describe_filter(brand, drink_types, min_calories, max_calories))
+        if not drinks:
+            return f"找不到符合條件（{condition}）的飲料"
+        
+        prefix = f"{condition}中" if condition else ''
+        result = f"{prefix}熱量最{'低' if lightest else '高'}的 {len(drinks)} 款飲料：\n\n"
+        for i, drink in enumerate(drinks, 1):
+            result += f"{i}. {drink.brand} {drink.drink_name}：{drink.calories} 大卡\n"
+        return result
+
+
+_drink_service: Optional[DrinkService] = None
+_drink_service_lock = threading.Lock()
+
+
+def get_drink_service() -> DrinkService:
+    """
+    取得全程序共用的 DrinkService（第一次使用時才初始化）
+    """
+    global _drink_service
+    if _drink_service is None:
+        with _drink_service_lock:
+            if _drink_service is None:
+                with startup_report.phase('init DrinkService'):
+                    _drink_service = DrinkService()
+    return _drink_service
@@ -0,0 +1,197 @@
+import threading
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.drink_catalog import BRAND_ALIASES, DRINK_ALIASES, DrinkCatalog, get_drink_catalog
+from app.services.fuzzy_matcher import normalize
+
+# 訊息中的關鍵字：分隔兩款飲料的連接詞，以及可忽略的助詞與指令詞
+SEPARATOR_KEYWORDS = ('和', '跟', '與', 'vs')
+FILLER_KEYWORDS = ('的', '比較', '想要', '我想')
+
+
+class Mention(NamedTuple):
+    kind: str  # 'brand'、'drink' 或 'keyword'
+    value: str  # 標準名稱（品牌別名會轉為品牌名稱）
+    start: int  # 在正規化文字中的位置
+    end: int
+
+
+class DrinkRef(NamedTuple):
+    brand: Optional[str]
+    drink_text: str  # 完全相符的飲料名稱，或留給模糊比對的文字
+
+
+class ParsedMessage(NamedTuple):
+    text: str  # 正規化後的文字
+    mentions: List[Mention]
+
+    @property
+    def brands(self) -> List[str]:
+        return [m.value for m in self.mentions if m.kind == 'brand']
+
+    @property
+    def keywords(self) -> List[str]:
+        return [m.value for m in self.mentions if m.kind == 'keyword']
+
+    def starts_with(self, keyword: str) -> bool:
+        return bool(self.mentions) and self.mentions[0].start == 0 and self.mentions[0].value == keyword
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多字串比對自動機：一次線性掃描找出文字中所有出現的字串
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每個狀態結束的字串：(長度, 資料)
+        self._out: List[List[Tuple[int, tuple]]] = [[]]
+
+    def add(self, pattern: str, payload: tuple):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((len(pattern), payload))
+
+    def build(self):
+        """
+        以廣度優先建立失敗連結，並合併經由失敗連結可達的輸出
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # 根節點的子節點失敗連結為根節點（預設值），從第二層開始計算
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str):
+        """
+        逐一回傳 (起點, 終點, 資料)
+        """
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, payload in self._out[state]:
+                yield i + 1 - length, i + 1, payload
+
+    def longest_matches(self, text: str) -> List[Tuple[int, int, tuple]]:
+        """
+        取得不重疊的 (起點, 終點, 資料)：同一位置取最長的字串，由左至右貪婪選取
+        """
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], m[0] - m[1]))
+        selected: List[Tuple[int, int, tuple]] = []
+        covered = 0
+        for start, end, payload in matches:
+            if start < covered:
+                continue
+            selected.append((start, end, payload))
+            covered = end
+        return selected
+
+
+class EntityExtractor:
+    """
+    從自由文字中找出品牌、飲料與關鍵字（由飲料目錄建立一次，解析時間只與訊息長度有關）
+    """
+
+    def __init__(self, catalog: DrinkCatalog):
+        self.catalog = catalog
+        self.version = catalog.version
+        self.automaton = AhoCorasick()
+
+        for brand in catalog.brands:
+            self.automaton.add(normalize(brand), ('brand', brand))
+        for brand, aliases in BRAND_ALIASES.items():
+            for alias in aliases:
+                self.automaton.add(normalize(alias), ('brand', brand))
+        drink_names = {drink.drink_name for drink in catalog.drinks}
+        for drink_name in drink_names:
+            self.automaton.add(normalize(drink_name), ('drink', drink_name))
+        for drink_name, aliases in DRINK_ALIASES.items():
+            if drink_name in drink_names:
+                for alias in aliases:
+                    self.automaton.add(normalize(alias), ('drink', drink_name))
+        for keyword in SEPARATOR_KEYWORDS + FILLER_KEYWORDS:
+            self.automaton.add(normalize(keyword), ('keyword', keyword))
+        self.automaton.build()
+
+    def parse(self, text: str) -> ParsedMessage:
+        """
+        找出訊息中所有不重疊的實體（同一位置取最長的字串）
+        """
+        text = normalize(text)
+        mentions = [
+            Mention(kind, value, start, end)
+            for start, end, (kind, value) in self.automaton.longest_matches(text)
+        ]
+        return ParsedMessage(text, mentions)
+
+    def drink_refs(self, parsed: ParsedMessage) -> List[DrinkRef]:
+        """
+        依連接詞（和、跟、與、vs）將訊息分段，每段取出 (品牌, 飲料文字)
+        """
+        refs: List[DrinkRef] = []
+        segment: List[Mention] = []
+        segment_start = 0
+        for mention in parsed.mentions + [Mention('keyword', SEPARATOR_KEYWORDS[0], len(parsed.text), len(parsed.text))]:
+            if mention.kind == 'keyword' and mention.value in SEPARATOR_KEYWORDS:
+                ref = self._segment_ref(parsed.text, segment_start, mention.start, segment)
+                if ref:
+                    refs.append(ref)
+                segment, segment_start = [], mention.end
+            else:
+                segment.append(mention)
+        return refs
+
+    def _segment_ref(self, text: str, start: int, end: int, mentions: List[Mention]) -> Optional[DrinkRef]:
+        brand = next((m.value for m in mentions if m.kind == 'brand'), None)
+        drink = next((m.value for m in mentions if m.kind == 'drink'), None)
+        if drink is None:
+            # 沒有完全相符的飲料名稱時，去掉品牌與助詞後的文字交給模糊比對
+            pieces, pos = [], start
+            for mention in mentions:
+                pieces.append(text[pos:mention.start])
+                pos = mention.end
+            pieces.append(text[pos:end])
+            drink = ''.join(pieces)
+        elif brand is None:
+            # 只有飲料名稱時，若只有一個品牌有這款飲料即可推得品牌
+            brands = {d.brand for d in self.catalog.get_name_drinks(drink)}
+            if len(brands) == 1:
+                brand = brands.pop()
+        if not brand and not drink:
+            return None
+        return DrinkRef(brand, drink)
+
+
+_extractor: Optional[EntityExtractor] = None
+_extractor_lock = threading.Lock()
+
+
+def get_entity_extractor() -> EntityExtractor:
+    """
+    取得全程序共用的實體擷取器，目錄版本變動時自動重建
+    """
+    global _extractor
+    catalog = get_drink_catalog()
+    if _extractor is None or _extractor.version != catalog.version:
+        with _extractor_lock:
+            if _extractor is None or _extractor.version != catalog.version:
+                _extractor = EntityExtractor(catalog)
+    return _extractor
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+# 處理事件的執行緒數量（同時處理的事件上限）與佇列中最多等待的事件數
+EVENT_WORKERS = int(os.getenv('EVENT_WORKERS', '8'))
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', '1000'))
+
+# 處理時間超過此值（毫秒）的事件會記錄到日誌；保留最近幾筆事件的計時
+SLOW_EVENT_MS = float(os.getenv('SLOW_EVENT_MS', '3000'))
+RECENT_EVENTS = 50
+
+
+class EventDispatcher:
+    """
+    有上限的事件處理執行緒池：同一個鍵（例如使用者）的事件依序處理，不同鍵的事件並行處理
+
+    每個鍵有自己的等待佇列；同一時間最多只有一個執行緒處理同一個鍵，
+    處理完一筆後該鍵重新排到就緒佇列尾端，讓其他使用者輪流取得執行緒。
+    """
+
+    def __init__(self, workers: int = EVENT_WORKERS, max_pending: int = EVENT_QUEUE_SIZE):
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._lanes: Dict[str, Deque[Tuple[Callable[[], Any], str, float]]] = {}
+        self._ready: Deque[str] = deque()
+        self._running: Set[str] = set()
+        self.pending = 0
+
+        self.max_pending_seen = 0
+        self.processed = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_wait_ms = 0.0
+        # 各類事件的計時：{類型: {"count", "total_ms", "max_ms"}}
+        self._timings: Dict[str, Dict[str, float]] = {}
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_EVENTS)
+
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"event-worker-{i}", daemon=True).start()
+
+    def submit(self, key: str, task: Callable[[], Any], label: str = 'event') -> bool:
+        """
+        排入事件；佇列已滿時回傳 False（由呼叫端決定如何處理）
+        :param key: 排序鍵，相同鍵的事件依序處理
+        :param label: 事件類型（用於計時統計）
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            lane = self._lanes.setdefault(key, deque())
+            lane.append((task, label, time.perf_counter()))
+            self.pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+            # 該鍵沒有在處理中也沒有在就緒佇列時，才排入就緒佇列
+            if len(lane) == 1 and key not in self._running:
+                self._ready.append(key)
+                self._wakeup.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._ready:
+                    self._wakeup.wait()
+                key = self._ready.popleft()
+                task, label, enqueued_at = self._lanes[key].popleft()
+                self._running.add(key)
+                self.pending -= 1
+                started_at = time.perf_counter()
+                wait_ms = (started_at - enqueued_at) * 1000
+                self.total_wait_ms += wait_ms
+
+            error = False
+            try:
+                task()
+            except Exception as e:
+                error = True
+                print(f"處理事件時發生錯誤：{str(e)}")
+            handle_ms = (time.perf_counter() - started_at) * 1000
+            if handle_ms >= SLOW_EVENT_MS:
+                print(f"事件處理過久：{label} 等待 {wait_ms:.0f} ms，處理 {handle_ms:.0f} ms")
+
+            with self._lock:
+                self._running.discard(key)
+                self.processed += 1
+                self.failures += int(error)
+                self._record(label, wait_ms, handle_ms, error)
+                if self._lanes[key]:
+                    self._ready.append(key)
+                    self._wakeup.notify()
+                else:
+                    del self._lanes[key]
+
+    def _record(self, label: str, wait_ms: float, handle_ms: float, error: bool):
+        timing = self._timings.setdefault(label, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        timing["count"] += 1
+        timing["total_ms"] += handle_ms
+        timing["max_ms"] = max(timing["max_ms"], handle_ms)
+        self._recent.append({
+            "event": label,
+            "wait_ms": round(wait_ms, 2),
+            "handle_ms": round(handle_ms, 2),
+            "error": error
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        取得佇列深度、處理統計與各類事件的計時
+        """
+        with self._lock:
+            started = self.processed + len(self._running)
+            return {
+                "workers": self.workers,
+                "active": len(self._running),
+                "queue_depth": self.pending,
+                "max_queue_depth": self.max_pending_seen,
+                "queue_limit": self.max_pending,
+                "waiting_keys": len(self._ready),
+                "processed": self.processed,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_ms / started, 2) if started else 0.0,
+                "events": {
+                    label: {
+                        "count": int(timing["count"]),
+                        "avg_ms": round(timing["total_ms"] / timing["count"], 2),
+                        "max_ms": round(timing["max_ms"], 2)
+                    }
+                    for label, timing in self._timings.items()
+                },
+                "recent": list(self._recent)
+            }
+
+
+_event_dispatcher: Optional[EventDispatcher] = None
+_event_dispatcher_lock = threading.Lock()
+
+
+def get_event_dispatcher() -> EventDispatcher:
+    """
+    取得全程序共用的事件處理執行緒池
+    """
+    global _event_dispatcher
+    if _event_dispatcher is None:
+        with _event_dispatcher_lock:
+            if _event_dispatcher is None:
+                _event_dispatcher = EventDispatcher()
+    return _event_dispatcher
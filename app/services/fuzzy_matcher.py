@@ -0,0 +1,271 @@
+import heapq
+import math
+import threading
+import unicodedata
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set
+
+from app.services.drink_catalog import BRAND_ALIASES, DRINK_ALIASES, Drink, DrinkCatalog, get_drink_catalog
+
+# 候選集合上限：超過時以更多查詢字元縮小範圍，確保每次查詢的計算量有上限
+MAX_CANDIDATES = 256
+# 自動採用最佳品牌所需的最低分數、與第二名的最小差距，以及查詢的最短長度（「清」之類的單字不自動採用）
+MIN_CONFIDENCE = 0.55
+MIN_MARGIN = 0.15
+MIN_QUERY_LENGTH = 3
+
+
+def normalize(text: str) -> str:
+    """
+    正規化查詢字串：全形轉半形、轉小寫、移除空白
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(text.split())
+
+
+def char_ngrams(text: str) -> FrozenSet[str]:
+    """
+    取得字串的單字元與雙字元 n-gram
+    """
+    grams: Set[str] = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return frozenset(grams)
+
+
+def _is_subsequence(query: str, target: str) -> bool:
+    it = iter(target)
+    return all(ch in it for ch in query)
+
+
+class Match(NamedTuple):
+    score: float
+    brand: str
+    drink_name: Optional[str]
+    text: str
+
+
+class _Entry(NamedTuple):
+    text: str
+    brand: str
+    drink_name: Optional[str]
+    grams: FrozenSet[str]
+
+
+class _NgramIndex:
+    """
+    字元 n-gram 倒排索引
+    """
+
+    def __init__(self, entries: List[_Entry]):
+        self.entries = entries
+        postings: Dict[str, Set[int]] = {}
+        for entry_id, entry in enumerate(entries):
+            for gram in entry.grams:
+                postings.setdefault(gram, set()).add(entry_id)
+        self.postings = postings
+
+        # 稀有的 n-gram 權重較高（IDF）
+        total = len(entries) or 1
+        self.idf = {
+            gram: math.log(1 + total / len(ids))
+            for gram, ids in postings.items()
+        }
+        self.weights = [self._weight(entry.grams) for entry in entries]
+
+    def _weight(self, grams: FrozenSet[str]) -> float:
+        # 查詢中未出現在索引的 n-gram 視為最稀有
+        unseen = math.log(1 + (len(self.entries) or 1))
+        return sum(self.idf.get(gram, unseen) for gram in grams)
+
+    def _candidates(self, grams: FrozenSet[str]) -> Set[int]:
+        # 由最稀有的 n-gram 開始收集候選
+        lists = sorted(
+            (self.postings[gram] for gram in grams if gram in self.postings),
+            key=len
+        )
+        if not lists:
+            return set()
+
+        candidates = set(lists[0])
+        rest = lists[1:]
+        if len(candidates) > MAX_CANDIDATES:
+            # 候選太多時，以其他 n-gram 取交集縮小範圍
+            for ids in rest:
+                narrowed = candidates & ids
+                if narrowed:
+                    candidates = narrowed
+                if len(candidates) <= MAX_CANDIDATES:
+                    break
+            if len(candidates) > MAX_CANDIDATES:
+                # 仍無法縮小（例如只輸入一個常見字）時，只保留索引中最前面的項目
+                candidates = set(heapq.nsmallest(MAX_CANDIDATES, candidates))
+        else:
+            # 候選不足時，以其他 n-gram 擴大範圍
+            for ids in rest:
+                if len(candidates) + len(ids) > MAX_CANDIDATES:
+                    break
+                candidates |= ids
+        return candidates
+
+    def search(self, query: str, k: int) -> List[Match]:
+        grams = char_ngrams(query)
+        if not grams:
+            return []
+
+        query_weight = self._weight(grams)
+        scored = []
+        for entry_id in self._candidates(grams):
+            entry = self.entries[entry_id]
+            overlap = sum(self.idf[gram] for gram in grams & entry.grams)
+            # 加權 Dice 係數
+            score = 2 * overlap / (query_weight + self.weights[entry_id])
+            # 縮寫（例如「珍奶」之於「珍珠奶茶」）依序出現時加分
+            if _is_subsequence(query, entry.text):
+                score += 0.2
+            # 不截斷分數：加分後超過 1 的結果仍依實際分數排序
+            scored.append((score, len(entry.text), entry_id))
+
+        scored.sort(key=lambda item: (-item[0], item[1], item[2]))
+
+        results = []
+        seen = set()
+        for score, _, entry_id in scored:
+            entry = self.entries[entry_id]
+            key = (entry.brand, entry.drink_name)
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(Match(round(score, 4), entry.brand, entry.drink_name, entry.text))
+            if len(results) >= k:
+                break
+        return results
+
+
+class FuzzyMatcher:
+    """
+    飲料與品牌的模糊比對引擎（索引只在建立時計算一次）
+    """
+
+    def __init__(self, catalog: DrinkCatalog, brand_aliases: Dict[str, List[str]] = BRAND_ALIASES,
+                 drink_aliases: Dict[str, List[str]] = DRINK_ALIASES):
+        self.version = catalog.version
+        self.catalog = catalog
+
+        # 品牌名稱與別名的精確對應
+        self._brand_lookup: Dict[str, str] = {}
+        brand_entries = []
+        for brand in catalog.brands:
+            names = [brand] + list(brand_aliases.get(brand, []))
+            for name in dict.fromkeys(names):
+                text = normalize(name)
+                self._brand_lookup[text] = brand
+                brand_entries.append(_Entry(text, brand, None, char_ngrams(text)))
+        self._brand_index = _NgramIndex(brand_entries)
+
+        # 飲料簡稱的精確對應（簡稱 -> 正式名稱）
+        self._drink_aliases = drink_aliases
+        self._drink_alias_lookup: Dict[str, str] = {
+            normalize(alias): drink_name
+            for drink_name, aliases in drink_aliases.items()
+            for alias in aliases
+        }
+
+        # 全部飲料的索引，以及各品牌各自的索引（簡稱也建立索引項目）
+        drink_entries = [entry for drink in catalog.drinks for entry in self._drink_entries(drink)]
+        self._drink_index = _NgramIndex(drink_entries)
+        self._brand_drink_index = {
+            brand: _NgramIndex([
+                entry for drink in catalog.get_brand_drinks(brand) for entry in self._drink_entries(drink)
+            ])
+            for brand in catalog.brands
+        }
+
+    def _drink_entries(self, drink: Drink) -> List[_Entry]:
+        entries = []
+        for name in [drink.drink_name] + list(self._drink_aliases.get(drink.drink_name, [])):
+            text = normalize(name)
+            entries.append(_Entry(text, drink.brand, drink.drink_name, char_ngrams(text)))
+        return entries
+
+    def match_brands(self, text: str, k: int = 3) -> List[Match]:
+        """
+        取得最相近的品牌（已轉換為正式名稱）
+        """
+        query = normalize(text)
+        if query in self._brand_lookup:
+            brand = self._brand_lookup[query]
+            return [Match(1.0, brand, None, query)]
+        return self._brand_index.search(query, k)
+
+    def resolve_brand(self, text: str) -> Optional[str]:
+        """
+        將使用者輸入的品牌名稱轉換為正式名稱，無法確定時回傳 None
+        """
+        query = normalize(text)
+        if query in self._brand_lookup:
+            return self._brand_lookup[query]
+        best = self._confident(query, self.match_brands(text))
+        return best.brand if best else None
+
+    def match_drinks(self, text: str, brand: Optional[str] = None, k: int = 5) -> List[Match]:
+        """
+        取得最相近的飲料，指定品牌時只在該品牌中搜尋
+        """
+        query = normalize(text)
+        if brand is None:
+            return self._drink_index.search(query, k)
+        index = self._brand_drink_index.get(brand)
+        return index.search(query, k) if index else []
+
+    def resolve_drink(self, brand: str, drink_name: str) -> Optional[Drink]:
+        """
+        將 (品牌, 飲料名稱) 轉換為目錄中的飲料：只接受完全相符的名稱或簡稱（例如「珍奶」），否則回傳 None
+
+        模糊比對的結果可能是另一款飲料（例如「奶茶」之於「鮮奶茶」），不自動採用，由呼叫端以 suggest_drinks 請使用者確認
+        """
+        drink = self.catalog.get(brand, drink_name)
+        if drink:
+            return drink
+
+        canonical_brand = self.resolve_brand(brand) if brand else None
+        alias_name = self._drink_alias_lookup.get(normalize(drink_name))
+        if canonical_brand:
+            for name in (drink_name, alias_name):
+                drink = self.catalog.get(canonical_brand, name) if name else None
+                if drink:
+                    return drink
+        return None
+
+    def suggest_drinks(self, brand: str, drink_name: str, k: int = 5) -> List[Drink]:
+        """
+        取得相近飲料的候選清單
+        """
+        canonical_brand = self.resolve_brand(brand) if brand else None
+        matches = self.match_drinks(drink_name, canonical_brand, k)
+        return [self.catalog.get(match.brand, match.drink_name) for match in matches]
+
+    @staticmethod
+    def _confident(query: str, matches: List[Match]) -> Optional[Match]:
+        if len(query) < MIN_QUERY_LENGTH:
+            return None
+        if not matches or matches[0].score < MIN_CONFIDENCE:
+            return None
+        if len(matches) > 1 and matches[0].score - matches[1].score < MIN_MARGIN:
+            return None
+        return matches[0]
+
+
+_matcher: Optional[FuzzyMatcher] = None
+_matcher_lock = threading.Lock()
+
+
+def get_fuzzy_matcher() -> FuzzyMatcher:
+    """
+    取得全程序共用的模糊比對引擎，目錄版本變動時自動重建
+    """
+    global _matcher
+    catalog = get_drink_catalog()
+    if _matcher is None or _matcher.version != catalog.version:
+        with _matcher_lock:
+            if _matcher is None or _matcher.version != catalog.version:
+                _matcher = FuzzyMatcher(catalog)
+    return _matcher
@@ -1,39 +1,120 @@
-import google.generativeai as genai
-import pandas as pd
 import os
-from typing import List, Dict
+import re
+import threading
+from typing import List, Dict, Optional
+
+from app.services.cache import TTLCache
+from app.services.drink_catalog import get_drink_catalog
+from app.services.drink_recommender import get_drink_recommender
+from app.services.drink_retriever import get_drink_retriever
+from app.services.fuzzy_matcher import normalize
+from app.services.single_flight import get_single_flight
+from app.services.startup_report import startup_report
+from app.services.upstream_guard import get_upstream_guard
+
+# 每次推薦放進提示的飲料數量上限
+CONTEXT_TOP_K = 20
+
+# Gemini 無法使用時，本地備援推薦的飲料數量
+LOCAL_RECOMMENDATION_COUNT = 3
+
+# 推薦結果快取：最多保留的筆數與存活時間（秒）
+RECOMMENDATION_CACHE_SIZE = 512
+RECOMMENDATION_CACHE_TTL = 6 * 60 * 60
+
+# 正規化使用者需求時忽略的標點符號
+_PUNCTUATION = re.compile(r'[\s,.!?~，。！？～、…]+')
+
+
+def normalize_request(user_input: str) -> str:
+    """
+    正規化使用者需求，讓語意相同的輸入共用同一筆快取
+    """
+    return _PUNCTUATION.sub('', normalize(user_input))
 
 class GeminiService:
     def __init__(self):
-        # 設定 Gemini API
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        # Gemini 模型在第一次推薦時才建立，避免啟動時載入 google.generativeai
+        self._model = None
+        self._model_lock = threading.Lock()
         
-        # 載入飲料資料
-        current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        csv_path = os.path.join(current_dir, 'data', 'drink_data.csv')
-        self.drinks_df = pd.read_csv(csv_path)
+        # 使用全程序共用的飲料目錄
+        self.catalog = get_drink_catalog()
+        # 每款飲料在提示中的文字與完整上下文，目錄版本變動時重建
+        self._lines: Dict = {}
+        self._full_context = ''
+        self._context_version = None
+        
+        # 推薦結果快取（以正規化後的需求與目錄版本為鍵）
+        self.recommendation_cache = TTLCache(
+            max_size=RECOMMENDATION_CACHE_SIZE,
+            ttl=RECOMMENDATION_CACHE_TTL
+        )
+        self.flight = get_single_flight('gemini')
+        self.guard = get_upstream_guard('gemini')
     
-    def _prepare_context(self) -> str:
+    @property
+    def model(self):
+        """
+        取得 Gemini 模型（第一次使用時才載入套件並設定 API）
         """
-        準備 RAG 的上下文資料
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    with startup_report.phase('import google.generativeai'):
+                        import google.generativeai as genai
+                    # 設定 Gemini API
+                    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+                    self._model = genai.GenerativeModel('gemini-2.0-flash')
+        return self._model
+    
+    @model.setter
+    def model(self, model):
+        self._model = model
+    
+    def _context_lines(self) -> Dict:
+        """
+        每款飲料在提示中的文字（每個目錄版本只建立一次）
+        """
+        if self._context_version != self.catalog.version:
+            # 將飲料資料轉換為易讀的格式
+            self._lines = {
+                drink: f"店家：{drink.brand}，飲料：{drink.drink_name}，"
+                       f"類型：{drink.type}，熱量：{drink.calories}大卡"
+                for drink in self.catalog.drinks
+            }
+            self._full_context = "\n".join(self._lines[drink] for drink in self.catalog.drinks)
+            self._context_version = self.catalog.version
+        return self._lines
+    
+    def _prepare_context(self, user_input: Optional[str] = None) -> str:
         """
-        # 將飲料資料轉換為易讀的格式
-        drinks_info = []
-        for _, row in self.drinks_df.iterrows():
-            drinks_info.append(
-                f"店家：{row['brand']}，飲料：{row['drink_name']}，"
-                f"類型：{row['type']}，熱量：{row['calories']}大卡"
-            )
+        準備 RAG 的上下文資料：只放入與需求最相關的飲料
+        """
+        lines = self._context_lines()
+        if user_input is None:
+            return self._full_context
         
-        return "\n".join(drinks_info)
+        drinks = get_drink_retriever().retrieve(user_input, k=CONTEXT_TOP_K)
+        return "\n".join(lines[drink] for drink in drinks)
     
     def get_drink_recommendations(self, user_input: str) -> str:
         """
         根據使用者輸入推薦飲料
         """
+        # 條件明確的需求（品牌、類型、熱量）直接由本地規則回答，不呼叫 Gemini
+        local = get_drink_recommender().recommend(user_input)
+        if local is not None:
+            return local
+        
+        # 相同需求且目錄未變動時直接回傳快取結果
+        cache_key = (normalize_request(user_input), self.catalog.version)
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         # 準備系統提示和上下文
-        context = self._prepare_context()
+        context = self._prepare_context(user_input)
         system_prompt = f"""你是一個飲料推薦專家。你只能根據以下資料庫中的飲料進行推薦。
 請根據使用者的需求，從資料庫中找出最適合的飲料，並說明推薦原因。
 如果使用者提到熱量，請特別注意飲料的熱量資訊。
@@ -56,8 +137,51 @@ class GeminiService:
         prompt = f"{system_prompt}\n\n使用者需求：{user_input}"
         
         try:
-            # 呼叫 Gemini API
-            response = self.model.generate_content(prompt)
-            return response.text
+            # 相同需求同時進來時只呼叫一次 Gemini API，共用結果或錯誤
+            return self.flight.do(cache_key, lambda: self._generate(cache_key, prompt))
         except Exception as e:
-            return f"抱歉，在處理您的請求時發生錯誤：{str(e)}" 
\ No newline at end of file
+            # Gemini 失敗、斷路器斷開或超過配額時，立即改用本地推薦
+            print(f"Gemini 推薦失敗，改用本地推薦：{str(e)}")
+            return self._local_recommendations(user_input)
+    
+    def _local_recommendations(self, user_input: str) -> str:
+        """
+        不呼叫 Gemini，直接以檢索結果回覆最相關的飲料
+        """
+        drinks = get_drink_retriever().retrieve(user_input, k=LOCAL_RECOMMENDATION_COUNT)
+        lines = [
+            f"{i}. {drink.brand} {drink.drink_name}（{drink.calories} 大卡）"
+            for i, drink in enumerate(drinks, 1)
+        ]
+        return "AI 推薦暫時忙碌中，先依照您的需求從資料庫中挑選：\n\n" + "\n".join(lines)
+    
+    def _generate(self, cache_key: tuple, prompt: str) -> str:
+        # 呼叫 Gemini API（經過速率限制與斷路器）
+        response = self.guard.call(lambda: self.model.generate_content(prompt))
+        self.recommendation_cache.set(cache_key, response.text)
+        return response.text
+
+
+_gemini_service: Optional[GeminiService] = None
+_gemini_service_lock = threading.Lock()
+
+
+def recommendation_cache_stats() -> Optional[Dict]:
+    """
+    取得推薦結果快取的命中統計；GeminiService 尚未初始化時回傳 None（不會因此初始化）
+    """
+    service = _gemini_service
+    return service.recommendation_cache.stats() if service is not None else None
+
+
+def get_gemini_service() -> GeminiService:
+    """
+    取得全程序共用的 GeminiService（第一次使用時才初始化）
+    """
+    global _gemini_service
+    if _gemini_service is None:
+        with _gemini_service_lock:
+            if _gemini_service is None:
+                with startup_report.phase('init GeminiService'):
+                    _gemini_service = GeminiService()
+    return _gemini_service
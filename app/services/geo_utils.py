@@ -0,0 +1,60 @@
+from typing import Sequence, Tuple
+
+import numpy as np
+
+# 地球平均半徑（公尺）
+EARTH_RADIUS = 6371008.8
+
+
+def haversine_distances(origin: Tuple[float, float], destinations: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    一次計算起點到多個目的地的直線（大圓）距離
+    :param origin: 起點座標 (緯度, 經度)
+    :param destinations: 目的地座標列表或 N x 2 陣列（緯度, 經度）
+    :return: 與 destinations 對應的距離陣列（公尺）
+    """
+    points = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    lat1, lon1 = np.radians(origin)
+    lat2 = np.radians(points[:, 0])
+    lon2 = np.radians(points[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    計算兩點之間的直線（大圓）距離（公尺）
+    """
+    return float(haversine_distances((lat1, lon1), [(lat2, lon2)])[0])
+
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = 7) -> str:
+    """
+    將座標編碼為 geohash（精度 7 約為 153 x 153 公尺的格子）
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        # 偶數位元切分經度，奇數位元切分緯度
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
@@ -0,0 +1,125 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 各外部端點的逾時設定（連線逾時, 讀取逾時），單位為秒
+ENDPOINT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    'places_nearby': (3.05, 5),
+    'distance_matrix': (3.05, 5),
+}
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# 連線池大小：每個主機最多保留的 keep-alive 連線數
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 20
+
+# 重試設定：最多重試次數與退避係數（0.3 秒、0.6 秒…）
+MAX_RETRIES = 2
+BACKOFF_FACTOR = 0.3
+
+
+class HttpClient:
+    """
+    共用的對外 HTTP 連線層：keep-alive 連線池、各端點逾時與有限次數的重試
+    """
+
+    def __init__(self):
+        retry = Retry(
+            total=MAX_RETRIES,
+            connect=MAX_RETRIES,
+            read=MAX_RETRIES,
+            status=MAX_RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def get(self, endpoint: str, url: str, params: Optional[Dict[str, Any]] = None,
+            timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        """
+        發送 GET 請求
+        :param endpoint: 端點名稱（決定逾時設定並用於統計）
+        :param url: 請求網址
+        :param params: 查詢參數
+        :param timeout: 覆寫預設的逾時設定
+        """
+        timeout = timeout or ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        start = time.perf_counter()
+        error = False
+        try:
+            return self.session.get(url, params=params, timeout=timeout)
+        except requests.RequestException:
+            error = True
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - start, error)
+
+    def _record(self, endpoint: str, elapsed: float, error: bool):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0
+            })
+            elapsed_ms = elapsed * 1000
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        取得各端點的延遲統計與連線池狀態
+        """
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    "calls": int(stats["calls"]),
+                    "errors": int(stats["errors"]),
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else 0.0,
+                    "max_ms": round(stats["max_ms"], 2)
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+        pools = {}
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools[f"{key.key_scheme}://{key.key_host}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool else 0
+            }
+        return {"endpoints": endpoints, "pools": pools}
+
+
+_http_client: Optional[HttpClient] = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """
+    取得全程序共用的 HTTP 連線層
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpClient()
+    return _http_client
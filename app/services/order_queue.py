@@ -0,0 +1,254 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Tuple
+
+from app.services.paths import DATA_DIR
+from app.services.upstream_guard import UpstreamUnavailable
+
+# 訂單日誌目錄：每個程序各自寫入一個日誌檔
+DEFAULT_JOURNAL_DIR = os.getenv('ORDER_JOURNAL_DIR', os.path.join(DATA_DIR, 'order_journal'))
+
+# 每批寫入的最多筆數與等待合併的時間（秒）
+FLUSH_BATCH_SIZE = 50
+FLUSH_INTERVAL = 2.0
+
+# 暫時性錯誤（例如超過 Sheets 配額、網路中斷）時的重試等待時間（秒）
+RETRY_BACKOFF_INITIAL = 2.0
+RETRY_BACKOFF_MAX = 60.0
+
+# 單筆訂單連續寫入失敗幾次後移到隔離檔，不再阻擋後面的訂單
+QUARANTINE_AFTER_FAILURES = 3
+QUARANTINE_FILE = 'quarantine.jsonl'
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    是否為稍後重試就可能成功的錯誤：配額限制（429）、伺服器錯誤（5xx）、網路錯誤或斷路器斷開
+    """
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return isinstance(error, (UpstreamUnavailable, OSError))
+
+
+class OrderQueue:
+    """
+    訂單寫回佇列：先寫入本地日誌檔並立即確認，再由背景執行緒批次寫入 Google Sheets
+
+    日誌檔是只會附加的 JSON Lines：
+    - {"op": "add", "id": ..., "row": [...]}：新的訂單
+    - {"op": "done", "ids": [...]}：已成功寫入試算表的訂單
+    - {"op": "quarantined", "ids": [...]}：一再寫入失敗、已移到隔離檔的訂單
+    程序重啟時，未標記完成的訂單會重新排入佇列（至少寫入一次）。
+    """
+
+    def __init__(self, flush_rows: Callable[[List[list]], None], journal_dir: str = DEFAULT_JOURNAL_DIR,
+                 is_transient: Callable[[Exception], bool] = is_transient_error):
+        self.flush_rows = flush_rows
+        self.is_transient = is_transient
+        self.journal_dir = journal_dir
+        self.quarantine_path = os.path.join(journal_dir, QUARANTINE_FILE)
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending: Dict[str, list] = {}
+        # 訂單編號 -> 單獨寫入失敗的次數
+        self._row_failures: Dict[str, int] = {}
+        self.flushed = 0
+        self.failures = 0
+        self.quarantined = 0
+
+        # 每個程序持有自己日誌檔的檔案鎖，其他程序可藉此判斷日誌是否已無人負責
+        self.journal_path = os.path.join(journal_dir, f"orders-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        self._replay_orphans()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        # 程序結束前盡量寫完佇列中的訂單，未寫完的留在日誌中由下一個程序接手
+        atexit.register(self.flush)
+
+    def enqueue(self, row: list) -> str:
+        """
+        將訂單寫入日誌並排入佇列，回傳訂單編號
+        """
+        order_id = uuid.uuid4().hex
+        with self._lock:
+            self._append({"op": "add", "id": order_id, "row": row})
+            self._pending[order_id] = row
+            if len(self._pending) >= FLUSH_BATCH_SIZE:
+                self._wakeup.notify()
+        return order_id
+
+    def _append(self, record: Dict):
+        # 寫入並同步到磁碟後才確認訂單
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    @staticmethod
+    def _read_pending(path: str) -> Dict[str, list]:
+        pending: Dict[str, list] = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 程序中斷時最後一行可能不完整
+                    continue
+                if record.get("op") == "add":
+                    pending[record["id"]] = record["row"]
+                elif record.get("op") in ("done", "quarantined"):
+                    for order_id in record["ids"]:
+                        pending.pop(order_id, None)
+        return pending
+
+    def _replay_orphans(self):
+        """
+        接手已結束程序留下的日誌檔，重新排入尚未寫入的訂單
+        """
+        for path in glob.glob(os.path.join(self.journal_dir, 'orders-*.jsonl')):
+            if path == self.journal_path:
+                continue
+            try:
+                with open(path, 'a+', encoding='utf-8') as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        # 日誌仍由其他執行中的程序持有
+                        continue
+                    pending = self._read_pending(path)
+                    with self._lock:
+                        for order_id, row in pending.items():
+                            self._append({"op": "add", "id": order_id, "row": row})
+                            self._pending[order_id] = row
+                    os.remove(path)
+                if pending:
+                    print(f"從日誌 {os.path.basename(path)} 重新排入 {len(pending)} 筆訂單")
+            except Exception as e:
+                print(f"重播訂單日誌 {path} 時發生錯誤：{str(e)}")
+
+    def _run(self):
+        backoff = RETRY_BACKOFF_INITIAL
+        while True:
+            with self._lock:
+                if len(self._pending) < FLUSH_BATCH_SIZE:
+                    self._wakeup.wait(FLUSH_INTERVAL)
+                batch = list(self._pending.items())[:FLUSH_BATCH_SIZE]
+            if not batch:
+                continue
+
+            rejected: List[Tuple[str, list, Exception]] = []
+            try:
+                written = self._flush_batch(batch, rejected)
+                if rejected and not written:
+                    # 每一筆都寫不進去：錯誤與個別訂單無關（例如試算表設定錯誤），整批稍後重試
+                    raise rejected[0][2]
+            except Exception as e:
+                self.failures += 1
+                print(f"批次寫入 {len(batch)} 筆訂單失敗：{str(e)}，{backoff:.0f} 秒後重試")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+                continue
+
+            backoff = RETRY_BACKOFF_INITIAL
+            for order_id, row, error in rejected:
+                self._reject(order_id, row, error)
+
+    def _flush_batch(self, batch: List[Tuple[str, list]], rejected: List[Tuple[str, list, Exception]]) -> int:
+        """
+        寫入一批訂單，回傳成功寫入的筆數
+
+        非暫時性錯誤時將批次對半拆開重試，單獨寫入仍失敗的訂單加入 rejected；
+        暫時性錯誤直接拋出，由呼叫端等待後重試
+        """
+        try:
+            self.flush_rows([row for _, row in batch])
+        except Exception as e:
+            if self.is_transient(e):
+                raise
+            if len(batch) == 1:
+                order_id, row = batch[0]
+                rejected.append((order_id, row, e))
+                return 0
+            middle = len(batch) // 2
+            return self._flush_batch(batch[:middle], rejected) + self._flush_batch(batch[middle:], rejected)
+
+        ids = [order_id for order_id, _ in batch]
+        with self._lock:
+            self._append({"op": "done", "ids": ids})
+            self._finish(ids)
+            self.flushed += len(ids)
+        print(f"批次寫入 {len(batch)} 筆訂單")
+        return len(ids)
+
+    def _reject(self, order_id: str, row: list, error: Exception):
+        """
+        記錄單筆訂單寫入失敗；連續失敗太多次時移到隔離檔
+        """
+        self.failures += 1
+        failures = self._row_failures.get(order_id, 0) + 1
+        if failures >= QUARANTINE_AFTER_FAILURES:
+            self._quarantine(order_id, row, error)
+            return
+        self._row_failures[order_id] = failures
+        print(f"寫入訂單 {order_id} 失敗（第 {failures} 次）：{str(error)}")
+
+    def _quarantine(self, order_id: str, row: list, error: Exception):
+        """
+        將一再寫入失敗的訂單移到隔離檔（保留供人工處理），不再重試
+        """
+        with self._lock:
+            with open(self.quarantine_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"id": order_id, "row": row, "error": str(error), "at": time.time()},
+                                   ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._append({"op": "quarantined", "ids": [order_id]})
+            self._finish([order_id])
+            self.quarantined += 1
+        print(f"訂單 {order_id} 連續 {QUARANTINE_AFTER_FAILURES} 次寫入失敗，已移到 {self.quarantine_path}：{str(error)}")
+
+    def _finish(self, ids: List[str]):
+        # 呼叫端需持有 self._lock
+        for order_id in ids:
+            self._pending.pop(order_id, None)
+            self._row_failures.pop(order_id, None)
+        if not self._pending:
+            self._compact()
+
+    def _compact(self):
+        # 所有訂單都已寫入時清空日誌，避免檔案無限成長
+        self._journal.seek(0)
+        self._journal.truncate()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        喚醒背景執行緒並等待佇列清空（例如關閉程序前）
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return True
+                self._wakeup.notify()
+            time.sleep(0.05)
+        return False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "flushed": self.flushed,
+            "failures": self.failures,
+            "quarantined": self.quarantined
+        }
@@ -0,0 +1,258 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from app.services.paths import DATA_DIR
+from app.services.sqlite_utils import thread_connection
+
+# 本地訂單資料庫（Google Sheets 的可查詢副本）
+DEFAULT_ORDER_DB_PATH = os.getenv('ORDER_DB_PATH', os.path.join(DATA_DIR, 'orders.sqlite3'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    location TEXT NOT NULL,
+    drink_name TEXT NOT NULL,
+    calories INTEGER NOT NULL,
+    date_time TEXT NOT NULL,
+    sheet_row INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user_time ON orders (user_id, date_time);
+CREATE INDEX IF NOT EXISTS idx_orders_sheet_row ON orders (sheet_row);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 每位使用者每日的彙總（杯數、熱量）與每日各品牌杯數，由觸發器隨訂單增刪即時更新
+_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    calories INTEGER NOT NULL,
+    PRIMARY KEY (user_id, date)
+);
+CREATE TABLE IF NOT EXISTS daily_brand_rollups (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, date, brand)
+);
+CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_insert AFTER INSERT ON orders
+BEGIN
+    INSERT INTO daily_rollups (user_id, date, count, calories)
+    VALUES (NEW.user_id, substr(NEW.date_time, 1, 10), 1, NEW.calories)
+    ON CONFLICT(user_id, date) DO UPDATE SET
+        count = count + 1, calories = calories + excluded.calories;
+    INSERT INTO daily_brand_rollups (user_id, date, brand, count)
+    VALUES (NEW.user_id, substr(NEW.date_time, 1, 10), NEW.brand, 1)
+    ON CONFLICT(user_id, date, brand) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_delete AFTER DELETE ON orders
+BEGIN
+    UPDATE daily_rollups SET count = count - 1, calories = calories - OLD.calories
+    WHERE user_id = OLD.user_id AND date = substr(OLD.date_time, 1, 10);
+    DELETE FROM daily_rollups
+    WHERE user_id = OLD.user_id AND date = substr(OLD.date_time, 1, 10) AND count <= 0;
+    UPDATE daily_brand_rollups SET count = count - 1
+    WHERE user_id = OLD.user_id AND date = substr(OLD.date_time, 1, 10) AND brand = OLD.brand;
+    DELETE FROM daily_brand_rollups
+    WHERE user_id = OLD.user_id AND date = substr(OLD.date_time, 1, 10) AND brand = OLD.brand AND count <= 0;
+END;
+"""
+
+# 由既有訂單重建彙總（只在彙總表第一次建立時執行）
+_ROLLUP_BACKFILL = """
+BEGIN;
+DELETE FROM daily_rollups;
+DELETE FROM daily_brand_rollups;
+INSERT INTO daily_rollups (user_id, date, count, calories)
+SELECT user_id, substr(date_time, 1, 10), COUNT(*), SUM(calories)
+FROM orders GROUP BY user_id, substr(date_time, 1, 10);
+INSERT INTO daily_brand_rollups (user_id, date, brand, count)
+SELECT user_id, substr(date_time, 1, 10), brand, COUNT(*)
+FROM orders GROUP BY user_id, substr(date_time, 1, 10), brand;
+COMMIT;
+"""
+
+
+def order_key(row: list) -> str:
+    """
+    以訂單內容產生編號，讓本地寫入與從試算表匯入的同一筆訂單不會重複
+    """
+    text = "|".join(str(value) for value in row)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class OrderStore:
+    """
+    本地訂單資料庫：以 (user_id, date_time) 索引，歷史查詢只需範圍掃描
+    """
+
+    def __init__(self, db_path: str = DEFAULT_ORDER_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            # 舊版資料庫沒有 sheet_row 欄位
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(orders)")]
+            if columns and 'sheet_row' not in columns:
+                conn.execute("ALTER TABLE orders ADD COLUMN sheet_row INTEGER")
+            conn.executescript(_SCHEMA)
+            # 舊版資料庫沒有彙總表：建立後以既有訂單補算一次
+            has_rollups = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_rollups'"
+            ).fetchone()
+            conn.executescript(_ROLLUP_SCHEMA)
+            if not has_rollups:
+                conn.executescript(_ROLLUP_BACKFILL)
+
+    def _connect(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.db_path)
+
+    def add_order(self, row: list):
+        """
+        新增一筆訂單
+        :param row: [user_id, brand, location, drink_name, calories, date_time]
+        """
+        self.add_orders([row])
+
+    def add_orders(self, rows: Iterable[list], sheet_rows: Optional[Iterable[int]] = None):
+        """
+        批次新增訂單（已存在的訂單會被略過）
+        :param sheet_rows: 訂單在試算表中的列號（從試算表同步時提供）
+        """
+        records = []
+        sheet_rows = list(sheet_rows) if sheet_rows is not None else None
+        for i, row in enumerate(rows):
+            row = [str(row[0]), row[1], row[2], row[3], int(row[4]), str(row[5])]
+            sheet_row = sheet_rows[i] if sheet_rows is not None else None
+            records.append([order_key(row)] + row + [sheet_row])
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO orders "
+                "(id, user_id, brand, location, drink_name, calories, date_time, sheet_row) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET sheet_row = COALESCE(excluded.sheet_row, sheet_row)",
+                records
+            )
+
+    def replace_sheet_rows(self, first_row: int, last_row: int, rows: List[list], sheet_rows: List[int]):
+        """
+        以試算表的內容取代某段列號的訂單（用於偵測到舊資料被修改時）
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM orders WHERE sheet_row BETWEEN ? AND ?",
+                (first_row, last_row)
+            )
+        self.add_orders(rows, sheet_rows)
+
+    def try_acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        取得跨程序的租約（例如只讓一個 worker 執行同步），租約過期後其他程序可接手
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+            if row:
+                holder, expires_at = row["value"].rsplit("|", 1)
+                if holder != owner and float(expires_at) > now:
+                    return False
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (name, f"{owner}|{now + ttl}")
+            )
+        return True
+
+    def get_orders(self, user_id: str, start_date: str, end_date: str) -> List[Dict]:
+        """
+        取得使用者在日期區間內的訂單（新到舊）
+        :param start_date: 開始日期（YYYY-MM-DD）
+        :param end_date: 結束日期（YYYY-MM-DD，包含當天）
+        """
+        next_day = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        rows = self._connect().execute(
+            "SELECT user_id, brand, location, drink_name, calories, date_time FROM orders "
+            "WHERE user_id = ? AND date_time >= ? AND date_time < ? "
+            "ORDER BY date_time DESC",
+            (user_id, start_date, next_day)
+        ).fetchall()
+        return [
+            {
+                "user_id": row["user_id"],
+                "brand": row["brand"],
+                "location": row["location"],
+                "drink_name": row["drink_name"],
+                "calories": row["calories"],
+                "created_at": row["date_time"]
+            }
+            for row in rows
+        ]
+
+    def get_daily_rollups(self, user_id: str, start_date: str, end_date: str) -> List[Dict]:
+        """
+        取得使用者在日期區間內每日的杯數與熱量（舊到新），成本只與天數有關
+        :param start_date: 開始日期（YYYY-MM-DD）
+        :param end_date: 結束日期（YYYY-MM-DD，包含當天）
+        """
+        rows = self._connect().execute(
+            "SELECT date, count, calories FROM daily_rollups "
+            "WHERE user_id = ? AND date BETWEEN ? AND ? ORDER BY date",
+            (user_id, start_date, end_date)
+        ).fetchall()
+        return [{"date": row["date"], "count": row["count"], "calories": row["calories"]} for row in rows]
+
+    def get_brand_counts(self, user_id: str, start_date: str, end_date: str) -> Dict[str, int]:
+        """
+        取得使用者在日期區間內各品牌的杯數（多到少）
+        """
+        rows = self._connect().execute(
+            "SELECT brand, SUM(count) AS count FROM daily_brand_rollups "
+            "WHERE user_id = ? AND date BETWEEN ? AND ? "
+            "GROUP BY brand ORDER BY count DESC",
+            (user_id, start_date, end_date)
+        ).fetchall()
+        return {row["brand"]: row["count"] for row in rows}
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def delete_meta(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+_order_store: Optional[OrderStore] = None
+_order_store_lock = threading.Lock()
+
+
+def get_order_store() -> OrderStore:
+    """
+    取得全程序共用的本地訂單資料庫
+    """
+    global _order_store
+    if _order_store is None:
+        with _order_store_lock:
+            if _order_store is None:
+                _order_store = OrderStore()
+    return _order_store
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Tuple
+
+from app.services.order_store import OrderStore
+from app.services.upstream_guard import get_upstream_guard
+
+# 試算表欄位順序（與 save_order 寫入的順序相同）：
+# user_id, brand, location, drink_name, calories, date_time
+HEADER_ROWS = 1
+
+# 新增列的同步間隔與整份檢查碼比對的間隔（秒）
+SYNC_INTERVAL = 60
+CHECKSUM_INTERVAL = 30 * 60
+# 檢查碼以多少列為一個區塊
+CHECKSUM_BLOCK_SIZE = 500
+
+# 同步租約：同一時間只有一個 worker 程序負責同步
+SYNC_LEASE_TTL = SYNC_INTERVAL * 3
+
+
+class OrderSync:
+    """
+    從 Google Sheets 增量同步訂單到本地資料庫
+
+    - 新增列：記住已同步的列數，只以範圍讀取新增的列
+    - 修改舊列：定期以區塊檢查碼比對，只重新匯入有變動的區塊
+    """
+
+    def __init__(self, store: OrderStore, get_worksheet: Callable):
+        self.store = store
+        self.get_worksheet = get_worksheet
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.guard = get_upstream_guard('sheets')
+        # 本程序的同步嘗試次數與失敗次數，以及是否已等待過第一次同步
+        self.attempts = 0
+        self.failures = 0
+        self._waited = False
+
+    @property
+    def synced_rows(self):
+        value = self.store.get_meta('sheet_synced_rows')
+        return int(value) if value is not None else None
+
+    @staticmethod
+    def _parse(values: List[list], first_row: int) -> Tuple[List[list], List[int]]:
+        """
+        解析試算表的列，回傳 (有效的訂單, 對應的列號)
+        """
+        rows, sheet_rows = [], []
+        for offset, value in enumerate(values):
+            # 空白或不完整的列視為無效資料
+            if len(value) < 6 or not value[0]:
+                continue
+            try:
+                int(value[4])
+            except (TypeError, ValueError):
+                continue
+            rows.append(value[:6])
+            sheet_rows.append(first_row + offset)
+        return rows, sheet_rows
+
+    def sync_new_rows(self) -> int:
+        """
+        只讀取上次同步之後新增的列，回傳新增的列數
+        """
+        synced = self.synced_rows or HEADER_ROWS
+        first_row = synced + 1
+        values = self.guard.call(lambda: self.get_worksheet().get_values(f"A{first_row}:F"))
+        if values:
+            self.store.add_orders(*self._parse(values, first_row))
+            print(f"從 Google Sheets 同步 {len(values)} 筆新訂單")
+        # 無效的列也計入列數，保持列號與試算表一致
+        self.store.set_meta('sheet_synced_rows', str(synced + len(values)))
+        return len(values)
+
+    def verify_checksums(self) -> int:
+        """
+        以區塊檢查碼比對試算表與本地資料，重新匯入有變動的區塊，回傳重新匯入的區塊數
+        """
+        values = self.guard.call(lambda: self.get_worksheet().get_values(f"A{HEADER_ROWS + 1}:F"))
+        old_checksums = json.loads(self.store.get_meta('sheet_block_checksums') or '[]')
+        new_checksums = []
+        changed = 0
+        for index, start in enumerate(range(0, len(values), CHECKSUM_BLOCK_SIZE)):
+            block = values[start:start + CHECKSUM_BLOCK_SIZE]
+            checksum = hashlib.sha1(json.dumps(block, ensure_ascii=False).encode('utf-8')).hexdigest()
+            new_checksums.append(checksum)
+            if index < len(old_checksums) and old_checksums[index] == checksum:
+                continue
+            first_row = HEADER_ROWS + 1 + start
+            self.store.replace_sheet_rows(first_row, first_row + CHECKSUM_BLOCK_SIZE - 1, *self._parse(block, first_row))
+            changed += 1
+
+        # 試算表的列被刪除時，移除超出範圍的本地資料
+        total_rows = HEADER_ROWS + len(values)
+        if self.synced_rows and self.synced_rows > total_rows:
+            self.store.replace_sheet_rows(total_rows + 1, self.synced_rows, [], [])
+        self.store.set_meta('sheet_block_checksums', json.dumps(new_checksums))
+        self.store.set_meta('sheet_synced_rows', str(total_rows))
+        if changed:
+            print(f"檢查碼比對：重新匯入 {changed} 個區塊")
+        return changed
+
+    @property
+    def sync_failed(self) -> bool:
+        """
+        最近一次同步是否失敗（本程序或持有租約的其他 worker 程序）
+        """
+        return self.store.get_meta('sheet_sync_failed_at') is not None
+
+    def wait_for_initial_sync(self, timeout: float) -> bool:
+        """
+        等待第一次同步完成（可能由其他 worker 程序執行），回傳是否已完成
+
+        每個程序最多等待一次；同步失敗時（Google Sheets 無法使用、憑證錯誤等）立即回傳，不再等待
+        """
+        if self._waited:
+            return self.synced_rows is not None
+        self._waited = True
+        deadline = time.monotonic() + timeout
+        while self.synced_rows is None:
+            if self.sync_failed or time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def run_forever(self):
+        """
+        背景同步迴圈：只有取得租約的程序會實際呼叫 Google Sheets
+        """
+        # 第一次取得租約時立即以檢查碼比對整份試算表
+        last_checksum = -CHECKSUM_INTERVAL
+        while True:
+            try:
+                if self.store.try_acquire_lease('sheet_sync_lease', self.owner, SYNC_LEASE_TTL):
+                    self.attempts += 1
+                    if time.monotonic() - last_checksum >= CHECKSUM_INTERVAL:
+                        self.verify_checksums()
+                        last_checksum = time.monotonic()
+                    else:
+                        self.sync_new_rows()
+                    self.store.delete_meta('sheet_sync_failed_at')
+            except Exception as e:
+                self.failures += 1
+                # 記錄到資料庫，讓其他 worker 程序也不必等待第一次同步
+                self.store.set_meta('sheet_sync_failed_at', str(time.time()))
+                print(f"同步 Google Sheets 訂單時發生錯誤：{str(e)}")
+            time.sleep(SYNC_INTERVAL)
+
+    def start(self):
+        threading.Thread(target=self.run_forever, daemon=True).start()
@@ -0,0 +1,5 @@
+import os
+
+# 專案根目錄與資料目錄
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
@@ -0,0 +1,18 @@
+import sqlite3
+import threading
+
+
+def thread_connection(local: threading.local, db_path: str) -> sqlite3.Connection:
+    """
+    取得目前執行緒的 SQLite 連線（第一次使用時建立）
+
+    每個執行緒使用各自的連線；WAL 模式讓多個 worker 程序可同時讀寫
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn = conn
+    return conn
@@ -0,0 +1,54 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# 程序開始載入的時間點（本模組是最早被載入的模組之一）
+_process_start = time.perf_counter()
+
+
+class StartupReport:
+    """
+    記錄啟動與各服務第一次初始化所花的時間
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases: List[Dict] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        量測一個啟動階段，例如：with startup_report.phase('import flask'): ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, start)
+
+    def record(self, name: str, seconds: float, started_at: float = None):
+        with self._lock:
+            self._phases.append({
+                "name": name,
+                "ms": round(seconds * 1000, 2),
+                "at_ms": round(((started_at or time.perf_counter()) - _process_start) * 1000, 2)
+            })
+
+    def report(self) -> Dict:
+        """
+        取得啟動時間報告（依耗時排序）
+        """
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase["ms"], reverse=True)
+        return {
+            "uptime_ms": round((time.perf_counter() - _process_start) * 1000, 2),
+            "phases": phases
+        }
+
+    def summary(self) -> str:
+        lines = [f"{phase['name']}：{phase['ms']} ms" for phase in self.report()["phases"]]
+        return "啟動時間報告：\n" + "\n".join(lines)
+
+
+startup_report = StartupReport()
@@ -0,0 +1,173 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from app.services.cache import TTLCache
+from app.services.paths import DATA_DIR
+from app.services.sqlite_utils import thread_connection
+
+# 對話狀態的後端：sqlite（多個 gunicorn worker 共用）或 memory（單一程序）
+STATE_STORE_BACKEND = os.getenv('STATE_STORE_BACKEND', 'sqlite')
+DEFAULT_STATE_DB_PATH = os.getenv('STATE_DB_PATH', os.path.join(DATA_DIR, 'user_states.sqlite3'))
+
+# 對話狀態的存活時間（秒）與最多保留的使用者數量
+STATE_TTL = int(os.getenv('STATE_TTL', str(30 * 60)))
+STATE_MAX_USERS = int(os.getenv('STATE_MAX_USERS', '10000'))
+
+# SQLite 後端每寫入幾次清理一次過期的狀態
+STATE_PRUNE_EVERY = 200
+
+
+class StateStore(ABC):
+    """
+    使用者對話狀態的介面：每位使用者一個 dict，閒置超過 TTL 後自動失效
+    """
+
+    @abstractmethod
+    def get(self, user_id: str) -> Dict[str, Any]:
+        """
+        取得使用者的狀態（沒有狀態時回傳空 dict）
+        """
+
+    @abstractmethod
+    def set(self, user_id: str, state: Dict[str, Any]):
+        """
+        以新的內容取代使用者的狀態
+        """
+
+    @abstractmethod
+    def clear(self, user_id: str):
+        """
+        清除使用者的狀態
+        """
+
+    def update(self, user_id: str, **fields) -> Dict[str, Any]:
+        """
+        更新使用者狀態中的部分欄位，回傳更新後的狀態
+        """
+        state = self.get(user_id)
+        state.update(fields)
+        self.set(user_id, state)
+        return state
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """
+        取得後端名稱與目前保存的使用者數量
+        """
+
+
+class MemoryStateStore(StateStore):
+    """
+    存在程序記憶體中的對話狀態（LRU + TTL），只適用於單一 worker
+    """
+
+    def __init__(self, max_users: int = STATE_MAX_USERS, ttl: float = STATE_TTL):
+        self.cache = TTLCache(max_size=max_users, ttl=ttl)
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        # 回傳複本，呼叫端修改後需以 set/update 寫回（與 SQLite 後端行為一致）
+        return dict(self.cache.get(user_id) or {})
+
+    def set(self, user_id: str, state: Dict[str, Any]):
+        if state:
+            self.cache.set(user_id, dict(state))
+        else:
+            self.cache.pop(user_id)
+
+    def clear(self, user_id: str):
+        self.cache.pop(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self.cache.stats()}
+
+
+class SQLiteStateStore(StateStore):
+    """
+    存在 SQLite 的對話狀態，同一台機器上的多個 worker 程序共用
+    """
+
+    def __init__(self, db_path: str = DEFAULT_STATE_DB_PATH, max_users: int = STATE_MAX_USERS,
+                 ttl: float = STATE_TTL):
+        self.db_path = db_path
+        self.max_users = max_users
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_states ("
+                "user_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_user_states_expires ON user_states (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.db_path)
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        row = self._connect().execute(
+            "SELECT state FROM user_states WHERE user_id = ? AND expires_at > ?",
+            (user_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def set(self, user_id: str, state: Dict[str, Any]):
+        if not state:
+            self.clear(user_id)
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_states (user_id, state, expires_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(state, ensure_ascii=False), time.time() + self.ttl)
+            )
+        self._writes += 1
+        if self._writes % STATE_PRUNE_EVERY == 0:
+            self.prune()
+
+    def clear(self, user_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+
+    def prune(self):
+        """
+        刪除過期的狀態；超過使用者數量上限時刪除最久未更新的狀態
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM user_states WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM user_states WHERE user_id IN ("
+                "SELECT user_id FROM user_states ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_users,)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        size = self._connect().execute(
+            "SELECT COUNT(*) FROM user_states WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+        return {"backend": "sqlite", "size": size, "max_size": self.max_users}
+
+
+_state_store: Optional[StateStore] = None
+_state_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    """
+    取得全程序共用的對話狀態儲存（依 STATE_STORE_BACKEND 選擇後端）
+    """
+    global _state_store
+    if _state_store is None:
+        with _state_store_lock:
+            if _state_store is None:
+                if STATE_STORE_BACKEND == 'memory':
+                    _state_store = MemoryStateStore()
+                elif STATE_STORE_BACKEND == 'sqlite':
+                    _state_store = SQLiteStateStore()
+                else:
+                    raise ValueError(f"不支援的對話狀態後端：{STATE_STORE_BACKEND}")
+    return _state_store
@@ -0,0 +1,304 @@
+import atexit
+import csv
+import fcntl
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.geo_utils import haversine_distance, haversine_distances
+from app.services.paths import DATA_DIR
+
+# 店家資料檔與已搜尋範圍檔由執行期寫入，預設放在不納入版本控制的目錄
+STORE_INDEX_DIR = os.getenv('STORE_INDEX_DIR', os.path.join(DATA_DIR, 'store_index'))
+DEFAULT_STORE_CSV_PATH = os.path.join(STORE_INDEX_DIR, 'store_data.csv')
+STORE_FIELDS = ['brand', 'place_id', 'name', 'address', 'rating', 'lat', 'lng', 'seen_at']
+COVERAGE_FIELDS = ['brand', 'lat', 'lng', 'radius', 'searched_at']
+
+# 已搜尋範圍的有效期間（秒）：超過後重新以 Places API 搜尋，取得新開或歇業的店家
+STORE_COVERAGE_TTL = int(os.getenv('STORE_COVERAGE_TTL', str(30 * 24 * 60 * 60)))
+# 新增的店家與搜尋範圍每隔多久（秒）批次寫回資料檔
+STORE_SAVE_INTERVAL = 60
+
+# 格子大小（度），在台灣約 1.1 x 1.0 公里
+GRID_CELL_DEGREES = 0.01
+METERS_PER_DEGREE = 111320.0
+
+
+def _cell(lat: float, lng: float) -> Tuple[int, int]:
+    return math.floor(lat / GRID_CELL_DEGREES), math.floor(lng / GRID_CELL_DEGREES)
+
+
+def _read_csv(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def _write_csv(path: str, fields: List[str], rows: List[Dict]):
+    # 先寫入暫存檔再取代，避免程序中斷時留下不完整的檔案
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+class StoreIndex:
+    """
+    本地店家空間索引：依品牌與經緯度格子分桶，離線回答最近店家查詢
+
+    只有完整搜尋過的範圍（已搜尋範圍）才能由索引回答，其他地方的店家可能尚未收錄。
+    """
+
+    def __init__(self, csv_path: str = DEFAULT_STORE_CSV_PATH, coverage_path: Optional[str] = None):
+        self.csv_path = csv_path
+        self.coverage_path = coverage_path or os.path.join(os.path.dirname(csv_path), 'store_coverage.csv')
+        self._lock = threading.Lock()
+        self._stores: Dict[str, Dict] = {}
+        self._buckets: Dict[Tuple[str, int, int], List[Dict]] = {}
+        # (品牌, 中心緯度, 中心經度) -> 搜尋範圍；依中心所在格子分桶
+        self._coverage: Dict[Tuple[str, float, float], Dict] = {}
+        self._coverage_buckets: Dict[Tuple[str, int, int], List[Dict]] = {}
+        self._max_coverage_radius = 0.0
+        self._dirty = False
+        self._saver_started = False
+        self.load()
+
+    def load(self):
+        """
+        讀取店家資料檔與已搜尋範圍檔並重建索引
+        """
+        stores, coverage = self._read_files()
+        with self._lock:
+            self._stores = stores
+            self._coverage = coverage
+            self._rebuild()
+
+    def _read_files(self) -> Tuple[Dict[str, Dict], Dict[Tuple[str, float, float], Dict]]:
+        stores = {}
+        for row in _read_csv(self.csv_path):
+            row['lat'] = float(row['lat'])
+            row['lng'] = float(row['lng'])
+            row['seen_at'] = float(row.get('seen_at') or 0)
+            self._merge_store(stores, row)
+        coverage = {}
+        for row in _read_csv(self.coverage_path):
+            record = {
+                'brand': row['brand'],
+                'lat': float(row['lat']),
+                'lng': float(row['lng']),
+                'radius': float(row['radius']),
+                'searched_at': float(row['searched_at'])
+            }
+            self._merge_coverage(coverage, record)
+        return stores, coverage
+
+    @staticmethod
+    def _merge_coverage(coverage: Dict[Tuple[str, float, float], Dict], record: Dict):
+        # 同一個中心只保留最近一次的搜尋
+        key = (record['brand'], round(record['lat'], 5), round(record['lng'], 5))
+        current = coverage.get(key)
+        if current is None or record['searched_at'] >= current['searched_at']:
+            coverage[key] = record
+
+    @classmethod
+    def _merge_store(cls, stores: Dict[str, Dict], store: Dict):
+        # 同一間店只保留最近一次搜尋到的資料
+        key = cls._key(store)
+        current = stores.get(key)
+        if current is None or store['seen_at'] >= current['seen_at']:
+            stores[key] = store
+
+    @staticmethod
+    def _key(store: Dict) -> str:
+        # 沒有 place_id 時以品牌、店名與座標識別
+        return store.get('place_id') or f"{store['brand']}|{store['name']}|{store['lat']:.6f},{store['lng']:.6f}"
+
+    def _rebuild(self):
+        coverage_buckets: Dict[Tuple[str, int, int], List[Dict]] = {}
+        for record in self._coverage.values():
+            coverage_buckets.setdefault((record['brand'],) + _cell(record['lat'], record['lng']), []).append(record)
+        self._coverage_buckets = coverage_buckets
+        self._max_coverage_radius = max((r['radius'] for r in self._coverage.values()), default=0.0)
+
+        # 之後重新完整搜尋過、卻沒再出現的店家（已歇業或搬遷）不再提供
+        self._stores = {key: store for key, store in self._stores.items() if not self._is_stale(store)}
+        buckets: Dict[Tuple[str, int, int], List[Dict]] = {}
+        for store in self._stores.values():
+            buckets.setdefault((store['brand'],) + _cell(store['lat'], store['lng']), []).append(store)
+        self._buckets = buckets
+
+    def _is_stale(self, store: Dict) -> bool:
+        """
+        店家所在位置是否在最後一次看到它之後又被完整搜尋過
+        """
+        (min_row, min_col), (max_row, max_col) = self._cell_range((store['lat'], store['lng']), self._max_coverage_radius)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for record in self._coverage_buckets.get((store['brand'], row, col), ()):
+                    if record['searched_at'] <= store['seen_at']:
+                        continue
+                    if haversine_distance(store['lat'], store['lng'], record['lat'], record['lng']) <= record['radius']:
+                        return True
+        return False
+
+    @staticmethod
+    def _cell_range(location: Tuple[float, float], radius: float) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        取得以 location 為中心、半徑 radius 的範圍所涵蓋的格子（左下、右上）
+        """
+        lat, lng = location
+        dlat = radius / METERS_PER_DEGREE
+        dlng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        return _cell(lat - dlat, lng - dlng), _cell(lat + dlat, lng + dlng)
+
+    def is_covered(self, brand: str, location: Tuple[float, float], radius: float) -> bool:
+        """
+        以 location 為中心、半徑 radius 的範圍是否完全落在有效期間內的某次搜尋範圍中
+        """
+        (min_row, min_col), (max_row, max_col) = self._cell_range(location, self._max_coverage_radius)
+        buckets = self._coverage_buckets
+        oldest = time.time() - STORE_COVERAGE_TTL
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for record in buckets.get((brand, row, col), ()):
+                    if record['searched_at'] < oldest:
+                        continue
+                    distance = haversine_distance(location[0], location[1], record['lat'], record['lng'])
+                    if distance + radius <= record['radius']:
+                        return True
+        return False
+
+    def nearest(self, brand: str, location: Tuple[float, float], radius: float, k: int = 3) -> List[Tuple[Dict, float]]:
+        """
+        查詢某品牌在半徑內最近的 k 間店家
+        :return: (店家資料, 直線距離公尺) 的列表，依距離排序
+        """
+        (min_row, min_col), (max_row, max_col) = self._cell_range(location, radius)
+
+        buckets = self._buckets
+        stores = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                stores.extend(buckets.get((brand, row, col), ()))
+        if not stores:
+            return []
+
+        distances = haversine_distances(location, [(store['lat'], store['lng']) for store in stores])
+        order = np.argsort(distances)
+        return [
+            (stores[i], float(distances[i]))
+            for i in order[:k]
+            if distances[i] <= radius
+        ]
+
+    def record_search(self, brand: str, location: Tuple[float, float], radius: float, stores: List[Dict],
+                      complete: bool, save: bool = True) -> int:
+        """
+        匯入一次 Places API 搜尋的結果，回傳新增的店家數量
+        :param complete: 搜尋是否完整；完整時記錄為已搜尋範圍，範圍內未再出現的舊店家一併移除
+        :param save: 是否排入背景批次寫回資料檔（不在呼叫端的執行緒寫檔）
+        """
+        searched_at = time.time()
+        added = 0
+        with self._lock:
+            for store in stores:
+                record = {field: store.get(field, '') for field in STORE_FIELDS}
+                record['brand'] = brand
+                record['lat'] = float(store['lat'])
+                record['lng'] = float(store['lng'])
+                record['seen_at'] = searched_at
+                key = self._key(record)
+                if key not in self._stores:
+                    added += 1
+                self._stores[key] = record
+            if complete:
+                self._merge_coverage(self._coverage, {
+                    'brand': brand,
+                    'lat': float(location[0]),
+                    'lng': float(location[1]),
+                    'radius': float(radius),
+                    'searched_at': searched_at
+                })
+            self._rebuild()
+            self._dirty = True
+        if save:
+            self._schedule_save()
+        return added
+
+    def _schedule_save(self):
+        """
+        啟動背景寫檔執行緒（每個程序一個），定期寫回有變動的資料
+        """
+        with self._lock:
+            if self._saver_started:
+                return
+            self._saver_started = True
+        threading.Thread(target=self._save_loop, name='store-index-saver', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _save_loop(self):
+        while True:
+            time.sleep(STORE_SAVE_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """
+        有變動時寫回資料檔
+        """
+        if self._dirty:
+            try:
+                self.save()
+            except Exception as e:
+                print(f"寫回店家資料檔時發生錯誤：{str(e)}")
+
+    def save(self):
+        """
+        將目前的店家資料與已搜尋範圍寫回資料檔
+
+        寫入前先合併檔案中其他 worker 程序寫入的資料，並以檔案鎖避免多個程序同時寫入
+        """
+        os.makedirs(os.path.dirname(self.csv_path) or '.', exist_ok=True)
+        with open(f"{self.csv_path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            disk_stores, disk_coverage = self._read_files()
+            with self._lock:
+                for store in disk_stores.values():
+                    self._merge_store(self._stores, store)
+                for record in disk_coverage.values():
+                    self._merge_coverage(self._coverage, record)
+                self._rebuild()
+                self._dirty = False
+                stores = list(self._stores.values())
+                coverage = list(self._coverage.values())
+            try:
+                _write_csv(self.csv_path, STORE_FIELDS, stores)
+                _write_csv(self.coverage_path, COVERAGE_FIELDS, coverage)
+            except Exception:
+                self._dirty = True
+                raise
+
+    def __len__(self) -> int:
+        return len(self._stores)
+
+
+_store_index: Optional[StoreIndex] = None
+_store_index_lock = threading.Lock()
+
+
+def get_store_index() -> StoreIndex:
+    """
+    取得全程序共用的店家索引（第一次呼叫時才載入）
+    """
+    global _store_index
+    if _store_index is None:
+        with _store_index_lock:
+            if _store_index is None:
+                _store_index = StoreIndex()
+    return _store_index
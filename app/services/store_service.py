@@ -1,17 +1,42 @@
-import googlemaps
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import os
-import pandas as pd
+import threading
 from typing import List, Dict, Tuple, Optional
-import requests
+import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
 import json
 
+from app.services.cache import TTLCache
+from app.services.drink_catalog import BRAND_ALIASES, get_drink_catalog
+from app.services.geo_utils import encode_geohash, haversine_distance, haversine_distances
+from app.services.http_client import DEFAULT_TIMEOUT, get_http_client
+from app.services.order_queue import OrderQueue
+from app.services.order_store import get_order_store
+from app.services.order_sync import OrderSync
+from app.services.single_flight import get_single_flight
+from app.services.upstream_guard import UpstreamUnavailable, get_upstream_guard
+from app.services.startup_report import startup_report
+from app.services.store_index import get_store_index
+
 # 載入環境變數
 load_dotenv()
 
+# 只回傳這個步行距離（公尺）內的店家
+MAX_STORE_DISTANCE = 1000
+# Distance Matrix API 單次請求最多的目的地數量
+DISTANCE_MATRIX_MAX_DESTINATIONS = 25
+# 附近店家快取：geohash 精度 7 的格子約 153 公尺見方，
+# 格內任一點 1 公里內的店家都落在原本 2 公里的搜尋範圍內
+STORE_CACHE_GEOHASH_PRECISION = 7
+STORE_CACHE_SIZE = 2048
+STORE_CACHE_TTL = 30 * 60
+# 歷史查詢等待第一次訂單同步的最長時間（秒）；每個程序最多等待一次，同步失敗時不等待
+INITIAL_SYNC_WAIT = 5
+# Maps API 表示服務端異常或超過配額的狀態（計入斷路器失敗）
+MAPS_ERROR_STATUSES = {'OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT', 'REQUEST_DENIED', 'UNKNOWN_ERROR'}
+# 店家搜尋模式：local（查詢範圍已搜尋過時由本地店家索引回答，否則呼叫 API）或 api（一律呼叫 API）
+STORE_SEARCH_MODE = os.getenv('STORE_SEARCH_MODE', 'local')
+
 class StoreService:
     def __init__(self):
         # 初始化 Google Maps API
@@ -19,49 +44,120 @@ class StoreService:
         if not self.google_api_key:
             raise ValueError("未設定 GOOGLE_MAPS_API_KEY 環境變數")
         
-        # 測試 API 金鑰是否有效
-        test_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-        test_params = {
-            "location": "25.0330,121.5654",  # 台北 101
-            "radius": 1000,
-            "keyword": "飲料店",
-            "key": self.google_api_key
-        }
-        response = requests.get(test_url, params=test_params)
-        if response.json().get("status") == "REQUEST_DENIED":
-            raise ValueError("Google Places API 金鑰無效或未啟用 Places API 服務")
-        
-        self.gmaps = googlemaps.Client(key=self.google_api_key)
+        # 共用的 HTTP 連線池（含逾時與重試）
+        self.http = get_http_client()
         
-        # 初始化 Google Sheets API
-        scope = ['https://spreadsheets.google.com/feeds',
-                'https://www.googleapis.com/auth/drive']
+        self._gmaps = None
         
-        # 從環境變數讀取認證資訊
+        # 從環境變數讀取 Google Sheets 認證資訊（第一次存取試算表時才授權）
         credentials_json = os.getenv('GOOGLE_SHEETS_CREDENTIALS')
         if not credentials_json:
             raise ValueError("未設定 GOOGLE_SHEETS_CREDENTIALS 環境變數")
         
         try:
-            credentials_dict = json.loads(credentials_json)
+            self._credentials_dict = json.loads(credentials_json)
             print("JSON 格式正確")
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict, scope)
-            self.gc = gspread.authorize(creds)
         except Exception as e:
             print(f"JSON 格式錯誤：{str(e)}")
             raise ValueError(f"Google Sheets 認證失敗：{str(e)}")
+        self._gc = None
+        self._worksheet = None
+        self._client_lock = threading.Lock()
         
-        # 載入飲料資料
-        current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        csv_path = os.path.join(current_dir, 'data', 'drink_data.csv')
-        self.drinks_df = pd.read_csv(csv_path)
+        # 使用全程序共用的飲料目錄
+        self.catalog = get_drink_catalog()
         
         # 品牌名稱對應關係
-        self.brand_mapping = {
-            '五十嵐': ['50嵐'],
-            '清心福全': ['清心福全'],
-            '麻古茶坊': ['麻古茶坊', '麻古', '麻古茶坊 MACU TEA']
+        self.brand_mapping = BRAND_ALIASES
+        
+        # 附近店家快取（以品牌與 geohash 格子為鍵）
+        self.store_cache = TTLCache(max_size=STORE_CACHE_SIZE, ttl=STORE_CACHE_TTL)
+        
+        # 本地店家索引
+        self.search_mode = STORE_SEARCH_MODE
+        self.store_index = get_store_index()
+        
+        # 合併相同的進行中外部呼叫
+        self.places_flight = get_single_flight('places')
+        self.distance_flight = get_single_flight('distance_matrix')
+        self.sheets_flight = get_single_flight('sheets')
+        
+        # 各外部服務的速率限制與斷路器
+        self.places_guard = get_upstream_guard('places')
+        self.distance_guard = get_upstream_guard('distance_matrix')
+        self.sheets_guard = get_upstream_guard('sheets')
+        
+        # 本地訂單資料庫（歷史查詢不需下載整份試算表），由背景增量同步 Google Sheets
+        self.order_store = get_order_store()
+        self.order_sync = OrderSync(self.order_store, self._get_worksheet)
+        self.order_sync.start()
+        
+        # 訂單寫回佇列（建立時會重播上次未寫入 Google Sheets 的訂單）
+        self.order_queue = OrderQueue(self._append_orders)
+        
+        # 在背景驗證 API 金鑰，不阻塞啟動
+        self.api_key_status = 'unknown'
+        threading.Thread(target=self.validate_api_key, daemon=True).start()
+    
+    def validate_api_key(self) -> bool:
+        """
+        測試 Google Places API 金鑰是否有效
+        :return: 金鑰是否有效（無法連線時視為有效，留待實際搜尋時再判斷）
+        """
+        test_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+        test_params = {
+            "location": "25.0330,121.5654",  # 台北 101
+            "radius": 1000,
+            "keyword": "飲料店",
+            "key": self.google_api_key
         }
+        try:
+            response = self.http.get('places_nearby', test_url, params=test_params)
+            if response.json().get("status") == "REQUEST_DENIED":
+                print("Google Places API 金鑰無效或未啟用 Places API 服務")
+                self.api_key_status = 'invalid'
+                return False
+            self.api_key_status = 'valid'
+        except Exception as e:
+            print(f"驗證 Google Places API 金鑰時發生錯誤：{str(e)}")
+        return True
+    
+    @property
+    def gmaps(self):
+        """
+        Google Maps 用戶端（第一次使用時才建立）
+        """
+        if self._gmaps is None:
+            with self._client_lock:
+                if self._gmaps is None:
+                    import googlemaps
+                    self._gmaps = googlemaps.Client(
+                        key=self.google_api_key,
+                        timeout=DEFAULT_TIMEOUT[1],
+                        requests_session=self.http.session
+                    )
+        return self._gmaps
+    
+    @property
+    def gc(self):
+        """
+        Google Sheets 用戶端（第一次使用時才授權）
+        """
+        if self._gc is None:
+            with self._client_lock:
+                if self._gc is None:
+                    with startup_report.phase('authorize gspread'):
+                        import gspread
+                        from oauth2client.service_account import ServiceAccountCredentials
+                        
+                        scope = ['https://spreadsheets.google.com/feeds',
+                                'https://www.googleapis.com/auth/drive']
+                        try:
+                            creds = ServiceAccountCredentials.from_json_keyfile_dict(self._credentials_dict, scope)
+                            self._gc = gspread.authorize(creds)
+                        except Exception as e:
+                            raise ValueError(f"Google Sheets 認證失敗：{str(e)}")
+        return self._gc
     
     def search_nearby_stores(self, brand: str, location: Tuple[float, float], radius: int = 2000) -> List[Dict]:
         """
@@ -72,110 +168,269 @@ class StoreService:
         :return: 店家列表（依照距離排序，只回傳 1 公里內的店家）
         """
         try:
-            # 品牌名稱對應關係
-            brand_keywords = {
-                '五十嵐': ['50嵐'],
-                '清心福全': ['清心福全'],
-                '麻古茶坊': ['麻古茶坊']
-            }
-            
-            # 取得搜尋關鍵字列表
-            search_keywords = brand_keywords.get(brand, [brand])
-            print(f"搜尋品牌：{brand}")
-            print(f"使用關鍵字：{search_keywords}")
+            # 同一個 geohash 格子內的位置共用 Places 搜尋結果
+            cell = encode_geohash(location[0], location[1], STORE_CACHE_GEOHASH_PRECISION)
+            cache_key = (brand, radius, cell)
+            candidates = self.store_cache.get(cache_key)
+            if candidates is not None:
+                print(f"使用快取的店家資料：brand={brand}, geohash={cell}")
+                # 快取命中時不呼叫任何外部 API，以直線距離估算步行距離重新排序
+                return self._rank_stores(location, candidates, walking=False)
             
-            # 收集所有店家資訊
-            all_stores = []
-            
-            # 使用每個關鍵字進行搜尋
-            for keyword in search_keywords:
-                url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-                params = {
-                    "location": f"{location[0]},{location[1]}",
-                    "radius": radius,
-                    "keyword": keyword,
-                    "language": "zh-TW",  # 設定為繁體中文
-                    "key": self.google_api_key
-                }
-                
-                print(f"搜尋關鍵字：{keyword}")
-                response = requests.get(url, params=params)
-                data = response.json()
-                
-                print(f"API 回應狀態：{data.get('status')}")
-                if data.get("status") == "OK":
-                    print(f"找到 {len(data['results'])} 個結果")
-                    for place in data["results"]:
-                        # 檢查店名是否包含關鍵字
-                        store_name = place["name"]
-                        if not any(kw in store_name for kw in search_keywords):
-                            print(f"跳過不符合的店家：{store_name}")
-                            continue
-                        
-                        # 計算距離
-                        distance = self._calculate_distance(
-                            location[0], location[1],
-                            place["geometry"]["location"]["lat"],
-                            place["geometry"]["location"]["lng"]
-                        )
-                        
-                        print(f"店家：{store_name}, 距離：{distance} 公尺")
-                        
-                        # 只加入 1 公里內的店家
-                        if distance <= 1000:
-                            store_info = {
-                                "name": store_name,
-                                "address": place.get("vicinity", "無地址資訊"),
-                                "rating": place.get("rating", "無評分"),
-                                "distance": int(distance)
-                            }
-                            
-                            # 避免重複的店家
-                            if not any(s["name"] == store_info["name"] for s in all_stores):
-                                all_stores.append(store_info)
-                                print(f"加入店家：{store_info['name']}")
-                else:
-                    print(f"搜尋失敗：{data.get('status')}")
+            # 查詢範圍已完整搜尋過時直接由本地店家索引回答，不需呼叫外部 API
+            if self.search_mode == 'local' and self.store_index.is_covered(brand, location, MAX_STORE_DISTANCE):
+                return self._search_local_stores(brand, location)
             
-            # 依照距離排序
-            all_stores.sort(key=lambda x: x['distance'])
-            print(f"最終找到 {len(all_stores)} 個符合條件的店家")
-            
-            # 只回傳前三筆結果
-            return all_stores[:3]
+            # 同一格子同時有多個查詢時只呼叫一次 Places API
+            candidates, failed = self.places_flight.do(
+                cache_key, lambda: self._fetch_places(cache_key, brand, location, radius)
+            )
+            if failed:
+                # Places API 呼叫失敗或被限流、斷路器拒絕：改用本地店家索引
+                stores = self._search_local_stores(brand, location)
+                if stores or not candidates:
+                    return stores
+            return self._rank_stores(location, candidates, walking=True)
         
         except Exception as e:
             print(f"搜尋店家時發生錯誤：{str(e)}")
             return []
     
-    def _calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    def _fetch_places(self, cache_key: tuple, brand: str, location: Tuple[float, float],
+                      radius: int) -> Tuple[List[Dict], bool]:
+        """
+        以 Places API 搜尋候選店家，寫入快取與本地店家索引
+        :return: (候選店家列表, 是否有關鍵字搜尋失敗)
+        """
+        candidates, complete, failed = self._search_places(brand, location, radius)
+        # 將 API 結果匯入本地店家索引（由背景執行緒批次寫回資料檔）
+        if candidates or complete:
+            self.store_index.record_search(brand, location, radius, candidates, complete)
+        if complete:
+            self.store_cache.set(cache_key, candidates)
+        return candidates, failed
+    
+    def _search_local_stores(self, brand: str, location: Tuple[float, float]) -> List[Dict]:
         """
-        使用 Google Maps Distance Matrix API 計算步行距離（公尺）
+        從本地店家索引查詢 1 公里內最近的三間店家
         """
         try:
-            url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+            nearest = self.store_index.nearest(brand, location, MAX_STORE_DISTANCE, k=3)
+        except Exception as e:
+            print(f"查詢本地店家索引時發生錯誤：{str(e)}")
+            return []
+        
+        print(f"本地店家索引找到 {len(nearest)} 個店家")
+        return [
+            {
+                "name": store["name"],
+                "address": store["address"] or "無地址資訊",
+                "rating": store["rating"] or "無評分",
+                "distance": int(distance)
+            }
+            for store, distance in nearest
+        ]
+    
+    def _search_places(self, brand: str, location: Tuple[float, float],
+                       radius: int) -> Tuple[List[Dict], bool, bool]:
+        """
+        使用 Places API 搜尋品牌的候選店家
+        :return: (候選店家列表, 是否取得範圍內所有店家, 是否有關鍵字搜尋失敗)
+        """
+        # 品牌名稱對應關係
+        brand_keywords = {
+            '五十嵐': ['50嵐'],
+            '清心福全': ['清心福全'],
+            '麻古茶坊': ['麻古茶坊']
+        }
+        
+        # 取得搜尋關鍵字列表
+        search_keywords = brand_keywords.get(brand, [brand])
+        print(f"搜尋品牌：{brand}")
+        print(f"使用關鍵字：{search_keywords}")
+        
+        # 收集所有候選店家
+        candidates = []
+        seen_place_ids = set()
+        complete = True
+        failed = False
+        
+        # 使用每個關鍵字進行搜尋
+        for keyword in search_keywords:
+            url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
             params = {
-                "origins": f"{lat1},{lon1}",
-                "destinations": f"{lat2},{lon2}",
-                "mode": "walking",
+                "location": f"{location[0]},{location[1]}",
+                "radius": radius,
+                "keyword": keyword,
+                "language": "zh-TW",  # 設定為繁體中文
                 "key": self.google_api_key
             }
             
-            response = requests.get(url, params=params)
-            data = response.json()
+            print(f"搜尋關鍵字：{keyword}")
+            try:
+                data = self._maps_get(self.places_guard, 'places_nearby', url, params)
+            except Exception as e:
+                print(f"搜尋關鍵字 {keyword} 時發生錯誤：{str(e)}")
+                complete = False
+                failed = True
+                continue
+            
+            print(f"API 回應狀態：{data.get('status')}")
+            if data.get("status") == "OK":
+                print(f"找到 {len(data['results'])} 個結果")
+                for place in data["results"]:
+                    # 檢查店名是否包含關鍵字
+                    store_name = place["name"]
+                    if not any(kw in store_name for kw in search_keywords):
+                        print(f"跳過不符合的店家：{store_name}")
+                        continue
+                    
+                    # 不同關鍵字可能搜尋到同一間店
+                    place_id = place.get("place_id")
+                    if place_id and place_id in seen_place_ids:
+                        continue
+                    seen_place_ids.add(place_id)
+                    candidates.append({
+                        "place_id": place_id,
+                        "name": store_name,
+                        "address": place.get("vicinity", "無地址資訊"),
+                        "rating": place.get("rating", "無評分"),
+                        "lat": place["geometry"]["location"]["lat"],
+                        "lng": place["geometry"]["location"]["lng"]
+                    })
+            elif data.get("status") != "ZERO_RESULTS":
+                print(f"搜尋失敗：{data.get('status')}")
+                complete = False
+                failed = True
+            
+            # 結果超過一頁時只取得第一頁，範圍內的店家不完整
+            if data.get("next_page_token"):
+                complete = False
+        
+        return candidates, complete, failed
+    
+    def _rank_stores(self, location: Tuple[float, float], candidates: List[Dict], walking: bool) -> List[Dict]:
+        """
+        依距離排序候選店家，只保留 1 公里內的前三間
+        :param walking: 是否使用 Distance Matrix API 取得步行距離（否則以直線距離估算）
+        """
+        if not candidates:
+            print("最終找到 0 個符合條件的店家")
+            return []
+        
+        # 步行距離不可能小於直線距離：先排除直線距離就超過 1 公里的店家
+        destinations = np.array([[store["lat"], store["lng"]] for store in candidates])
+        straight_distances = haversine_distances(location, destinations)
+        nearby = np.flatnonzero(straight_distances <= MAX_STORE_DISTANCE)
+        print(f"直線距離篩選後剩下 {len(nearby)} / {len(candidates)} 個店家")
+        
+        if walking:
+            # 一次取得所有候選店家的步行距離
+            distances = self._calculate_distances(
+                location,
+                [tuple(destinations[i]) for i in nearby],
+                [float(straight_distances[i]) for i in nearby]
+            )
+            # 記錄步行距離與直線距離的比例，供快取命中時估算步行距離
+            for i, distance in zip(nearby, distances):
+                if straight_distances[i] >= 50:
+                    candidates[i]["detour"] = min(max(distance / straight_distances[i], 1.0), 3.0)
+        else:
+            distances = [float(straight_distances[i]) * candidates[i].get("detour", 1.0) for i in nearby]
+        
+        # 收集所有店家資訊
+        all_stores = []
+        for i, distance in zip(nearby, distances):
+            store = candidates[i]
+            print(f"店家：{store['name']}, 距離：{distance} 公尺")
+            
+            # 只加入 1 公里內的店家
+            if distance <= MAX_STORE_DISTANCE:
+                store_info = {
+                    "name": store["name"],
+                    "address": store["address"],
+                    "rating": store["rating"],
+                    "distance": int(distance)
+                }
+                
+                # 避免重複的店家
+                if not any(s["name"] == store_info["name"] for s in all_stores):
+                    all_stores.append(store_info)
+                    print(f"加入店家：{store_info['name']}")
+        
+        # 依照距離排序
+        all_stores.sort(key=lambda x: x['distance'])
+        print(f"最終找到 {len(all_stores)} 個符合條件的店家")
+        
+        # 只回傳前三筆結果
+        return all_stores[:3]
+    
+    def _calculate_distances(self, origin: Tuple[float, float], destinations: List[Tuple[float, float]],
+                             fallbacks: Optional[List[float]] = None) -> List[float]:
+        """
+        使用單次（依上限分批）Distance Matrix 請求計算多個目的地的步行距離（公尺）
+        :param origin: 起點座標 (緯度, 經度)
+        :param destinations: 目的地座標列表
+        :param fallbacks: API 無法提供距離時使用的直線距離（未提供時自動計算）
+        :return: 與 destinations 對應的距離列表
+        """
+        if fallbacks is None:
+            fallbacks = haversine_distances(origin, destinations).tolist() if destinations else []
+        # 相同起點與目的地的進行中請求共用同一次 API 呼叫
+        key = (round(origin[0], 5), round(origin[1], 5), tuple(destinations))
+        return list(self.distance_flight.do(key, lambda: self._request_distances(origin, destinations, fallbacks)))
+    
+    def _request_distances(self, origin: Tuple[float, float], destinations: List[Tuple[float, float]],
+                           fallbacks: List[float]) -> List[float]:
+        distances = list(fallbacks)
+        url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+        for start in range(0, len(destinations), DISTANCE_MATRIX_MAX_DESTINATIONS):
+            chunk = destinations[start:start + DISTANCE_MATRIX_MAX_DESTINATIONS]
+            params = {
+                "origins": f"{origin[0]},{origin[1]}",
+                "destinations": "|".join(f"{lat},{lng}" for lat, lng in chunk),
+                "mode": "walking",
+                "key": self.google_api_key
+            }
             
-            if data["status"] == "OK" and data["rows"]:
-                # 取得步行距離（公尺）
-                distance = data["rows"][0]["elements"][0]["distance"]["value"]
-                return distance
-            else:
-                # 如果 API 呼叫失敗，回傳直線距離
-                return self._calculate_straight_line_distance(lat1, lon1, lat2, lon2)
+            try:
+                data = self._maps_get(self.distance_guard, 'distance_matrix', url, params)
                 
-        except Exception as e:
-            print(f"計算步行距離時發生錯誤：{str(e)}")
-            # 發生錯誤時回傳直線距離
-            return self._calculate_straight_line_distance(lat1, lon1, lat2, lon2)
+                if data["status"] != "OK" or not data["rows"]:
+                    print(f"Distance Matrix API 回應狀態：{data.get('status')}，改用直線距離")
+                    continue
+                
+                # 取得步行距離（公尺），個別失敗的目的地保留直線距離
+                for offset, element in enumerate(data["rows"][0]["elements"]):
+                    if element.get("status") == "OK":
+                        distances[start + offset] = element["distance"]["value"]
+            except Exception as e:
+                print(f"計算步行距離時發生錯誤：{str(e)}，改用直線距離")
+        
+        return distances
+    
+    def _maps_get(self, guard, endpoint: str, url: str, params: Dict) -> Dict:
+        """
+        在速率限制與斷路器保護下呼叫 Maps API；服務異常的回應狀態視為失敗
+        """
+        def request():
+            data = self.http.get(endpoint, url, params=params).json()
+            if data.get("status") in MAPS_ERROR_STATUSES:
+                raise RuntimeError(f"{endpoint} 回應狀態：{data.get('status')}")
+            return data
+        return guard.call(request)
+    
+    def _calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """
+        使用 Google Maps Distance Matrix API 計算步行距離（公尺），失敗時回傳直線距離
+        """
+        return self._calculate_distances((lat1, lon1), [(lat2, lon2)])[0]
+    
+    def _calculate_straight_line_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """
+        計算兩點之間的直線距離（公尺）
+        """
+        return haversine_distance(lat1, lon1, lat2, lon2)
     
     def get_drink_calories(self, brand: str, drink_name: str) -> Optional[int]:
         """
@@ -185,14 +440,7 @@ class StoreService:
         :return: 熱量（卡路里）
         """
         try:
-            # 讀取飲料資料
-            with open('data/drink_data.csv', 'r', encoding='utf-8') as f:
-                import csv
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row['brand'] == brand and row['drink_name'] == drink_name:
-                        return int(row['calories'])
-            return None
+            return self.catalog.get_calories(brand, drink_name)
         except Exception as e:
             print(f"取得飲料熱量時發生錯誤：{str(e)}")
             return None
@@ -222,34 +470,61 @@ class StoreService:
             if not sheets_id:
                 print("未設定 GOOGLE_SHEETS_ID 環境變數")
                 return False
-            print(f"使用 Google Sheets ID：{sheets_id}")
             
-            # 取得 Google Sheets 工作表
-            try:
-                sheet = self.gc.open_by_key(sheets_id).sheet1
-                print("成功開啟 Google Sheets")
-            except Exception as e:
-                print(f"開啟 Google Sheets 失敗：{str(e)}")
-                print("請確認：")
-                print("1. GOOGLE_SHEETS_ID 是否正確")
-                print("2. 服務帳號是否有權限存取該試算表")
-                print("3. 試算表是否已建立")
-                return False
+            # 寫入本地日誌後立即確認，由背景執行緒批次寫入 Google Sheets
+            order_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            row = [user_id, brand, location, drink_name, calories, order_time]
+            self.order_queue.enqueue(row)
             
-            # 新增訂單
+            # 同步寫入本地訂單資料庫，供歷史查詢使用（訂單已寫入日誌，失敗時不影響結果）
             try:
-                order_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                sheet.append_row([user_id, brand, location, drink_name, calories, order_time])
-                print("成功新增訂單")
-                return True
+                self.order_store.add_order(row)
             except Exception as e:
-                print(f"新增訂單失敗：{str(e)}")
-                return False
+                print(f"寫入本地訂單資料庫失敗：{str(e)}")
+            print("成功新增訂單（等待寫入 Google Sheets）")
+            return True
         
         except Exception as e:
             print(f"儲存訂單時發生錯誤：{str(e)}")
             return False
     
+    def _get_worksheet(self):
+        """
+        取得（並快取）訂單工作表
+        """
+        if self._worksheet is None:
+            # 寫入佇列與同步執行緒可能同時需要工作表，只開啟一次
+            self._worksheet = self.sheets_flight.do('worksheet', self._open_worksheet)
+        return self._worksheet
+    
+    def _open_worksheet(self):
+        sheets_id = os.getenv('GOOGLE_SHEETS_ID')
+        try:
+            worksheet = self.gc.open_by_key(sheets_id).sheet1
+            print("成功開啟 Google Sheets")
+            return worksheet
+        except Exception as e:
+            print(f"開啟 Google Sheets 失敗：{str(e)}")
+            print("請確認：")
+            print("1. GOOGLE_SHEETS_ID 是否正確")
+            print("2. 服務帳號是否有權限存取該試算表")
+            print("3. 試算表是否已建立")
+            raise
+    
+    def _append_orders(self, rows: List[list]):
+        """
+        以單次 append_rows 將多筆訂單寫入 Google Sheets
+        """
+        try:
+            # 斷路器斷開時立即失敗，訂單留在寫回佇列中稍後重試
+            self.sheets_guard.call(lambda: self._get_worksheet().append_rows(rows))
+        except UpstreamUnavailable:
+            raise
+        except Exception:
+            # 工作表可能已失效，下次重新開啟
+            self._worksheet = None
+            raise
+    
     def get_order_history(self, user_id: str, start_date: str, end_date: str) -> List[Dict]:
         """
         取得訂單歷史紀錄
@@ -259,34 +534,61 @@ class StoreService:
         :return: 訂單列表
         """
         try:
-            # 取得 Google Sheets 工作表
-            sheet = self.gc.open_by_key(os.getenv('GOOGLE_SHEETS_ID')).sheet1
-            
-            # 取得所有訂單
-            orders = sheet.get_all_records()
-            
-            # 過濾訂單
-            filtered_orders = []
-            for order in orders:
-                if order['user_id'] != user_id:
-                    continue
-                
-                order_date = order['date_time'].split()[0]  # 取得日期部分
-                if start_date <= order_date <= end_date:
-                    filtered_orders.append({
-                        "user_id": order['user_id'],
-                        "brand": order['brand'],
-                        "location": order['location'],
-                        "drink_name": order['drink_name'],
-                        "calories": int(order['calories']),
-                        "created_at": order['date_time']  # 使用 date_time 欄位
-                    })
-            
-            # 依照時間排序（新到舊）
-            filtered_orders.sort(key=lambda x: x['created_at'], reverse=True)
+            # 本地資料由背景同步維護；剛啟動時稍候第一次同步完成
+            if not self.order_sync.wait_for_initial_sync(timeout=INITIAL_SYNC_WAIT):
+                print("Google Sheets 訂單尚未同步完成，先回傳本地資料")
             
-            return filtered_orders
+            # 以 (user_id, date_time) 索引做範圍查詢（新到舊）
+            return self.order_store.get_orders(user_id, start_date, end_date)
         
         except Exception as e:
             print(f"取得訂單歷史紀錄時發生錯誤：{str(e)}")
-            return [] 
\ No newline at end of file
+            return []
+    
+    def get_order_statistics(self, user_id: str, start_date: str, end_date: str) -> Optional[Dict]:
+        """
+        取得訂單統計（由每日彙總計算，不需讀取原始訂單）
+        :param user_id: 使用者ID
+        :param start_date: 開始日期（YYYY-MM-DD）
+        :param end_date: 結束日期（YYYY-MM-DD）
+        :return: {"total_count", "total_calories", "daily": [{"date", "count", "calories"}], "brands": {品牌: 杯數}}
+        """
+        try:
+            if not self.order_sync.wait_for_initial_sync(timeout=INITIAL_SYNC_WAIT):
+                print("Google Sheets 訂單尚未同步完成，先回傳本地資料")
+            
+            daily = self.order_store.get_daily_rollups(user_id, start_date, end_date)
+            return {
+                "total_count": sum(day["count"] for day in daily),
+                "total_calories": sum(day["calories"] for day in daily),
+                "daily": daily,
+                "brands": self.order_store.get_brand_counts(user_id, start_date, end_date)
+            }
+        
+        except Exception as e:
+            print(f"取得訂單統計時發生錯誤：{str(e)}")
+            return None
+
+_store_service: Optional[StoreService] = None
+_store_service_lock = threading.Lock()
+
+
+def order_queue_stats() -> Optional[Dict]:
+    """
+    取得訂單寫回佇列的統計（待寫入、已寫入、失敗次數）；StoreService 尚未初始化時回傳 None（不會因此初始化）
+    """
+    service = _store_service
+    return service.order_queue.stats() if service is not None else None
+
+
+def get_store_service() -> StoreService:
+    """
+    取得全程序共用的 StoreService（第一次使用時才初始化）
+    """
+    global _store_service
+    if _store_service is None:
+        with _store_service_lock:
+            if _store_service is None:
+                with startup_report.phase('init StoreService'):
+                    _store_service = StoreService()
+    return _store_service
@@ -0,0 +1,183 @@
+import threading
+import time
+from typing import Any, Callable, Dict
+
+# 各外部服務的速率限制（每秒補充的權杖數, 權杖桶容量），依配額設定並保留餘裕：
+# - places：Places Nearby Search 每分鐘 600 次
+# - distance_matrix：Distance Matrix 每分鐘 600 次請求
+# - gemini：Gemini 免費方案每分鐘 15 次
+# - sheets：Sheets API 每位使用者每分鐘 60 次
+UPSTREAM_LIMITS: Dict[str, tuple] = {
+    'places': (8.0, 20),
+    'distance_matrix': (8.0, 20),
+    'gemini': (0.2, 5),
+    'sheets': (0.8, 10),
+}
+DEFAULT_LIMIT = (5.0, 10)
+
+# 斷路器：連續失敗幾次後斷開，斷開多久（秒）後允許一次試探呼叫
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+
+
+class UpstreamUnavailable(Exception):
+    """
+    外部服務暫時不可用（斷路器斷開或超過速率限制），呼叫端應改用備援方案
+    """
+
+
+class TokenBucket:
+    """
+    權杖桶速率限制：每秒補充 rate 個權杖，最多累積 capacity 個
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        """
+        取得一個權杖；沒有權杖時立即回傳 False（不等待）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            elapsed = time.monotonic() - self._updated_at
+            return min(self.capacity, self._tokens + elapsed * self.rate)
+
+
+class CircuitBreaker:
+    """
+    斷路器：closed（正常）→ 連續失敗達門檻 → open（直接失敗）→ 等待後 half_open（允許一次試探）
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """
+        放棄取得的試探機會（未實際呼叫外部服務時）
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"{self.name} 斷路器斷開（連續失敗 {self.failures} 次）")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class UpstreamGuard:
+    """
+    單一外部服務的保護層：速率限制 + 斷路器，無法呼叫時立即拋出 UpstreamUnavailable
+    """
+
+    def __init__(self, name: str, rate: float, capacity: int):
+        self.name = name
+        self.bucket = TokenBucket(rate, capacity)
+        self.breaker = CircuitBreaker(name)
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.short_circuited = 0
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        在保護下執行 fn()；fn 拋出例外視為一次失敗
+        """
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise UpstreamUnavailable(f"{self.name} 暫時無法使用（斷路器斷開）")
+        if not self.bucket.try_acquire():
+            # 沒有實際呼叫：釋放可能取得的試探機會，不影響斷路器狀態
+            self.breaker.release()
+            self.rate_limited += 1
+            raise UpstreamUnavailable(f"{self.name} 超過速率限制")
+
+        self.calls += 1
+        try:
+            result = fn()
+        except Exception:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "tokens": round(self.bucket.tokens, 2),
+            "calls": self.calls,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "short_circuited": self.short_circuited
+        }
+
+
+_guards: Dict[str, UpstreamGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_upstream_guard(name: str) -> UpstreamGuard:
+    """
+    取得外部服務的保護層（依 UPSTREAM_LIMITS 設定速率），同名的保護層全程序共用
+    """
+    with _guards_lock:
+        guard = _guards.get(name)
+        if guard is None:
+            rate, capacity = UPSTREAM_LIMITS.get(name, DEFAULT_LIMIT)
+            guard = _guards[name] = UpstreamGuard(name, rate, capacity)
+        return guard
+
+
+def upstream_guard_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    取得所有外部服務的斷路器狀態與速率限制統計
+    """
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.name: guard.stats() for guard in guards}
@@ -0,0 +1,43 @@
+import unittest
+
+from app.services.drink_catalog import get_drink_catalog
+from app.services.drink_recommender import get_drink_recommender
+
+
+class DrinkRecommenderParseTest(unittest.TestCase):
+    """
+    品牌與飲料名稱中的類型字詞（例如「麻古茶坊」、「蜜茶」中的「茶」）不應成為類型條件
+    """
+
+    def setUp(self):
+        self.recommender = get_drink_recommender()
+
+    def test_brand_containing_type_word(self):
+        constraints = self.recommender.parse('想要麻古茶坊的奶茶')
+        self.assertEqual(constraints.brand, '麻古茶坊')
+        self.assertEqual(constraints.types, ['奶茶'])
+
+        constraints = self.recommender.parse('想要麻古茶坊的飲料')
+        self.assertEqual(constraints.types, [])
+
+    def test_calorie_query_for_brand_containing_type_word(self):
+        constraints = self.recommender.parse('麻古茶坊熱量最低的前5名')
+        self.assertEqual(constraints.types, [])
+        self.assertEqual(constraints.order, 'low')
+        self.assertEqual(constraints.limit, 5)
+
+    def test_drink_name_containing_type_word(self):
+        constraints = self.recommender.parse('想要五十嵐的蜜茶')
+        self.assertEqual(constraints.drink_names, ['蜜茶'])
+        self.assertEqual(constraints.types, [])
+
+    def test_named_drink_is_recommended(self):
+        for drink in get_drink_catalog().drinks:
+            with self.subTest(drink=drink):
+                reply = self.recommender.recommend(f'想要{drink.brand}的{drink.drink_name}')
+                self.assertIsNotNone(reply)
+                self.assertIn(drink.drink_name, reply)
+
+
+if __name__ == '__main__':
+    unittest.main()